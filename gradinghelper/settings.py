@@ -104,9 +104,137 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': '/var/tmp/django_cache',
         'TIMEOUT': 3600
+    },
+    # Highlighted submission files. This is not an LRU cache: the number
+    # of entries is bounded by MAX_ENTRIES, and when the limit is reached
+    # the backend deletes a random third of the entries (CULL_FREQUENCY).
+    # Size of a single entry is bounded by RENDER_CACHE_MAX_FILE_SIZE.
+    'render': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/django_render_cache',
+        'TIMEOUT': 30 * 24 * 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000
+        }
+    },
+    # Responses of the A+ API, see APLUS_CACHE_TTL. Kept apart from the
+    # default cache, so that culling the responses doesn't drop the
+    # counters and synchronization keys stored there.
+    'aplus': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/django_aplus_cache',
+        'TIMEOUT': 7 * 24 * 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000
+        }
     }
 }
 
+# Larger submitted files (bytes) are highlighted but not cached.
+RENDER_CACHE_MAX_FILE_SIZE = 1024 * 1024
+
+# Submission data exports are read from Plussa in chunks of this size
+# (bytes) and sorted while they are downloaded.
+SUBMISSION_DATA_CHUNK_SIZE = 64 * 1024
+
+# Maximum number of concurrent requests to Plussa when a submission
+# is opened in the feedback view.
+SUBMISSION_FETCH_WORKERS = 4
+
+# PEP8 style checks of submitted files run in a pool of worker processes.
+# Set STYLE_CHECK_WORKERS = 0 to run them in the request thread instead.
+# Start method can be changed if the server can't spawn Python processes.
+STYLE_CHECK_WORKERS = 2
+STYLE_CHECK_TIMEOUT = 10
+STYLE_CHECK_START_METHOD = 'spawn'
+
+# Seconds to cache the feedback counters shown on the grading pages.
+# The cache is also invalidated whenever a feedback is saved.
+FEEDBACK_COUNTS_CACHE_TIMEOUT = 30
+
+# Seconds to cache the text of a feedback template. Entries are keyed by
+# the file name and modification time, so a replaced template is read again.
+FEEDBACK_BASE_CACHE_TIMEOUT = 24 * 3600
+
+
+# A+ API client. Requests made with the same API token share a pool of
+# keep-alive connections. Timeout is given as (connect, read) in seconds.
+APLUS_POOL_CONNECTIONS = 4
+APLUS_POOL_MAXSIZE = 10
+APLUS_TIMEOUT = (5, 60)
+APLUS_KEEP_ALIVE = True
+
+# Seconds A+ API responses are served from the cache before they are
+# revalidated with a conditional request, by resource type. Type is the
+# path after the API version with the ids replaced by "*". With 0 every
+# request is revalidated, resources not listed here are not cached.
+# Cached responses are kept in the aplus cache for APLUS_CACHE_TIMEOUT
+# seconds.
+APLUS_CACHE_TTL = {
+    'courses/*': 0,
+    'courses/*/exercises': 0,
+    # Modules, is_open changes at the deadline
+    'courses/*/exercises/*': 60,
+    # Exercise details, form_spec and max_points
+    'exercises/*': 600,
+    # Submissions don't change, only the grading data if regraded
+    'submissions/*': 3600,
+}
+APLUS_CACHE_TIMEOUT = 7 * 24 * 3600
+
+# Seconds the open states of the modules of a course are cached. All
+# exercises of the course polled within this time share one lookup.
+MODULE_STATES_TIMEOUT = 60
+
+# When a submission is opened, the data of the next PREFETCH_COUNT
+# submissions on the grader's list is fetched in the background by
+# PREFETCH_WORKERS threads. Set PREFETCH_COUNT = 0 to disable.
+# Opening a submission that is still being prefetched waits at most
+# PREFETCH_WAIT_TIMEOUT seconds for it.
+PREFETCH_COUNT = 3
+PREFETCH_WORKERS = 2
+PREFETCH_WAIT_TIMEOUT = 30
+
+# Feedbacks are posted to Plussa by the release job of the exercise, run
+# by run_jobs, RELEASE_WORKERS requests at a time in batches of
+# RELEASE_BATCH_SIZE. Requests which Plussa didn't handle (429, 503 and
+# failed connection attempts) are retried RELEASE_RETRIES times, waiting
+# RELEASE_BACKOFF seconds doubled on every attempt, at most
+# RELEASE_MAX_BACKOFF seconds. After 500, 502, 504 and lost connections
+# the outcome is unknown and the feedback is not posted again
+# automatically, see submissions.release.
+RELEASE_WORKERS = 4
+RELEASE_BATCH_SIZE = 20
+RELEASE_RETRIES = 3
+RELEASE_BACKOFF = 1
+RELEASE_MAX_BACKOFF = 60
+
+# Seconds the run_jobs worker waits before checking an empty job queue again.
+JOB_POLL_INTERVAL = 2
+
+# A running job updates its heartbeat every JOB_HEARTBEAT_INTERVAL seconds.
+# A job whose heartbeat is older than JOB_STALE_TIMEOUT was left running by
+# a stopped worker. It is marked failed and queued again.
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_STALE_TIMEOUT = 5 * 60
+
+# Exercises of a course are synchronized from Plussa on teacher's login
+# only if the previous synchronization is older than this (seconds).
+COURSE_SYNC_INTERVAL = 15 * 60
+
+# Grading daemon polls every exercise in grading on its own interval
+# (seconds). The interval is doubled from POLL_MIN_INTERVAL up to
+# POLL_MAX_INTERVAL while no new submissions are found. Exercises are
+# polled at POLL_MIN_INTERVAL for POLL_DEADLINE_WINDOW before and after
+# the module closing time. The list of exercises in grading is reloaded
+# every POLL_RESCAN_INTERVAL. The lock file keeps the daemon and the
+# update_submissions command from running at the same time.
+POLL_MIN_INTERVAL = 60
+POLL_MAX_INTERVAL = 30 * 60
+POLL_DEADLINE_WINDOW = 60 * 60
+POLL_RESCAN_INTERVAL = 60
+GRADING_DAEMON_LOCK_FILE = '/var/tmp/gradinghelper_daemon.lock'
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.0/topics/i18n/
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Course, User, BaseCourse, Exercise, Student, Feedback
+from .models import (Course, User, BaseCourse, Exercise, Student, Feedback,
+                     Job)
 
 admin.site.register(Course)
 admin.site.register(User, UserAdmin)
@@ -8,3 +9,4 @@ admin.site.register(BaseCourse)
 admin.site.register(Exercise)
 admin.site.register(Student)
 admin.site.register(Feedback)
+admin.site.register(Job)
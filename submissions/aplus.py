@@ -0,0 +1,173 @@
+"""
+Client for the A+ (Plussa) REST API. One client is shared per API token so
+that every request made with the same token reuses pooled keep-alive
+connections instead of opening a new TCP and TLS connection each time.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import requests
+
+from django.conf import settings
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+
+
+aplus_logger = logging.getLogger(__name__)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class APlusClient:
+    """
+    Thin wrapper around a pooled requests.Session authenticated with
+    a single A+ API token.
+    """
+
+    def __init__(self, token):
+        self.cache_prefix = "aplus_" + hashlib.sha256(
+            token.encode()
+        ).hexdigest()[:16]
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Token {token}"
+
+        if not settings.APLUS_KEEP_ALIVE:
+            self.session.headers["Connection"] = "close"
+
+        adapter = HTTPAdapter(
+            pool_connections=settings.APLUS_POOL_CONNECTIONS,
+            pool_maxsize=settings.APLUS_POOL_MAXSIZE,
+            pool_block=True
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = settings.APLUS_TIMEOUT
+
+    def get(self, url, params=None, **kwargs):
+        """
+        Make a GET request and return the response as is.
+        :param url: (str) resource url
+        :param params: (dict) query parameters
+        :return: (requests.Response)
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, params=params, **kwargs)
+
+    def get_json(self, url, params=None, ttl=None):
+        """
+        Make a GET request and return the decoded json body. Resources
+        listed in APLUS_CACHE_TTL are cached, see get_cached_json.
+        :param url: (str) resource url
+        :param params: (dict) query parameters
+        :param ttl: (int) seconds the response may be served from the cache,
+                    overrides APLUS_CACHE_TTL
+        :return: decoded json
+        """
+        if ttl is None:
+            ttl = settings.APLUS_CACHE_TTL.get(get_resource_type(url))
+
+        if ttl is not None:
+            return self.get_cached_json(url, params, ttl)
+
+        resp = self.get(url, params)
+
+        if resp.status_code == requests.codes.ok:
+            return resp.json()
+        else:
+            resp.raise_for_status()
+
+    def get_cached_json(self, url, params, ttl):
+        """
+        Return the decoded json body from the cache if it is younger than
+        ttl. An older entry is revalidated with a conditional request using
+        its ETag and Last-Modified headers, so an unchanged resource isn't
+        downloaded and decoded again. With ttl 0 every call is revalidated.
+        :param url: (str) resource url
+        :param params: (dict) query parameters
+        :param ttl: (int) seconds the response may be served from the cache
+        :return: decoded json
+        """
+        key = self.cache_prefix + hashlib.sha256(
+            f"{url}?{sorted((params or {}).items())}".encode()
+        ).hexdigest()
+        aplus_cache = caches["aplus"]
+        entry = aplus_cache.get(key)
+        now = time.time()
+
+        if entry is not None and entry["expires"] > now:
+            return entry["data"]
+
+        headers = {}
+
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        resp = self.get(url, params, headers=headers)
+
+        not_modified = resp.status_code == requests.codes.not_modified
+
+        if entry is not None and not_modified:
+            entry["expires"] = now + ttl
+        elif resp.status_code == requests.codes.ok:
+            entry = {
+                "data": resp.json(),
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "expires": now + ttl,
+            }
+        else:
+            resp.raise_for_status()
+            return None
+
+        # Entries are kept longer than ttl for revalidation
+        aplus_cache.set(key, entry, settings.APLUS_CACHE_TIMEOUT)
+        return entry["data"]
+
+    def post(self, url, json=None, **kwargs):
+        """
+        Make a POST request with a json body and return the response as is.
+        :param url: (str) resource url
+        :param json: (dict) request body
+        :return: (requests.Response)
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, json=json, **kwargs)
+
+
+def get_resource_type(url):
+    """
+    Name the type of an A+ API resource by its path after the API version,
+    with the ids replaced by "*", e.g. "courses/*/exercises".
+    :param url: (str) resource url
+    :return: (str) resource type
+    """
+    parts = [part for part in urlsplit(url).path.split("/") if part]
+
+    if "api" in parts:
+        parts = parts[parts.index("api") + 2:]
+
+    return "/".join("*" if part.isdigit() else part for part in parts)
+
+
+def get_client(token):
+    """
+    Return the shared client for the given API token. The client is
+    created on the first call.
+    :param token: (str) A+ API token
+    :return: (APlusClient)
+    """
+    with _clients_lock:
+        client = _clients.get(token)
+
+        if client is None:
+            client = APlusClient(token)
+            _clients[token] = client
+
+    return client
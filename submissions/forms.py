@@ -1,5 +1,6 @@
 from django import forms
 from .models import Exercise, Feedback, User
+from .utils import get_staff_choices
 from django.db.models import Q
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext as _
@@ -136,16 +137,27 @@ class ChangeGraderForm(forms.ModelForm):
         }
 
     def __init__(self, *args, **kwargs):
+        # Formsets pass the same precomputed choices to every form
+        grader_choices = kwargs.pop("grader_choices", None)
         super().__init__(*args, **kwargs)
-        course = kwargs["instance"].exercise.course
+        exercise_id = kwargs["instance"].exercise_id
         self.fields["grader"].queryset = User.objects.filter(
             Q(
-                courses_assistant=course.base_course
+                courses_assistant__course__exercise=exercise_id
             ) | Q(
-                courses_teacher=course.base_course
+                courses_teacher__course__exercise=exercise_id
             )
         ).distinct()
 
+        if grader_choices is None:
+            grader_choices = get_staff_choices(
+                kwargs["instance"].exercise.course.base_course_id
+            )
+
+        self.fields["grader"].choices = [
+            ("", self.fields["grader"].empty_label)
+        ] + grader_choices
+
 
 class FeedbackForm(ChangeGraderForm):
     class Meta(ChangeGraderForm.Meta):
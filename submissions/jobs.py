@@ -0,0 +1,158 @@
+"""
+Background jobs. Views add jobs to the queue with Job.objects.enqueue
+and the run_jobs management command runs them.
+
+A handler is registered for every job kind. The job arguments are passed
+to the handler as keyword arguments. Jobs with the same key don't run at
+the same time.
+
+A running job updates its heartbeat. Jobs left running by a stopped worker
+are found by their old heartbeat, marked failed and queued again.
+"""
+
+import logging
+import threading
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Course, Exercise, Job
+from . import release, utils
+
+
+job_logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """
+    Register the decorated function as the handler of the job kind.
+    :param kind: (str) job kind
+    """
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+@handler("get_exercises")
+def get_exercises(course_id):
+    utils.get_exercises(Course.objects.get(pk=course_id))
+
+
+@handler("update_submissions")
+def update_submissions(exercise_id):
+    utils.update_submissions(Exercise.objects.get(pk=exercise_id))
+
+
+@handler("apply_grading_settings")
+def apply_grading_settings(exercise_id):
+    utils.apply_grading_settings(Exercise.objects.get(pk=exercise_id))
+
+
+@handler("release")
+def release_feedbacks(exercise_id):
+    release.release_queued(exercise_id)
+
+
+def claim_job():
+    """
+    Mark the oldest queued job RUNNING. Jobs claimed by other workers and
+    jobs whose previous run is still running are skipped.
+    :return: (Job) model object or None if the queue is empty
+    """
+    with transaction.atomic():
+        running = Job.objects.filter(status=Job.RUNNING).values("key")
+        job = Job.objects.filter(
+            status=Job.QUEUED
+        ).exclude(
+            key__in=running
+        ).select_for_update(skip_locked=True).first()
+
+        if job is not None:
+            job.status = Job.RUNNING
+            job.started = timezone.now()
+            job.heartbeat = job.started
+            job.save(update_fields=["status", "started", "heartbeat"])
+
+    return job
+
+
+def reap_jobs():
+    """
+    Mark the jobs left running by a stopped worker FAILED and queue them
+    again.
+    :return: (list) reaped Job objects
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_STALE_TIMEOUT)
+
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.filter(
+                Q(heartbeat__lt=stale) |
+                Q(heartbeat__isnull=True, started__lt=stale),
+                status=Job.RUNNING
+            ).select_for_update(skip_locked=True)
+        )
+
+        for job in jobs:
+            job_logger.warning(f"Job {job.pk} was interrupted: {job}")
+            job.status = Job.FAILED
+            job.error = "Interrupted, the job was queued again"
+            job.finished = now
+            job.save(update_fields=["status", "error", "finished"])
+            Job.objects.enqueue(job.kind, user=job.user, **job.args)
+
+    return jobs
+
+
+def run_job(job):
+    """
+    Run the handler of the job and save the result. The heartbeat of the
+    job is updated in a separate thread meanwhile.
+    :param job: (Job) claimed model object
+    """
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=keep_alive, args=(job.pk, stopped),
+                                 daemon=True)
+    heartbeat.start()
+
+    try:
+        HANDLERS[job.kind](**job.args)
+        job.status = Job.DONE
+    except Exception as e:
+        job_logger.exception(f"Job {job} failed")
+        job.status = Job.FAILED
+        job.error = str(e) or repr(e)
+    finally:
+        stopped.set()
+        heartbeat.join()
+
+    job.finished = timezone.now()
+    job.save(update_fields=["status", "error", "finished"])
+
+
+def keep_alive(job_id, stopped):
+    """
+    Update the heartbeat of the running job every JOB_HEARTBEAT_INTERVAL
+    seconds until stopped is set.
+    :param job_id: (int) Job id
+    :param stopped: (threading.Event) set when the job has finished
+    """
+    try:
+        while not stopped.wait(settings.JOB_HEARTBEAT_INTERVAL):
+            try:
+                Job.objects.filter(pk=job_id, status=Job.RUNNING).update(
+                    heartbeat=timezone.now()
+                )
+            except DatabaseError as e:
+                job_logger.debug(e)
+                connection.close()
+    finally:
+        connection.close()
@@ -0,0 +1,108 @@
+"""
+Management command which polls the submissions of the exercises in grading
+continuously. This is ment to be run as a service instead of calling
+update_submissions from crontab. Database and Plussa connections stay open
+between the polls.
+
+Every exercise is polled on its own interval, see submissions.scheduler.
+Only one daemon can run at a time, and update_submissions doesn't run
+while the daemon is running.
+"""
+
+import logging
+import signal
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.utils import timezone
+from submissions.models import Exercise
+from submissions.scheduler import (AlreadyRunning, PollScheduler,
+                                   poll_exercises, single_instance_lock)
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Poll the submissions of the exercises in grading from Plussa."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Number of exercises fetched from Plussa concurrently"
+        )
+        parser.add_argument(
+            "--per-course", type=int, default=2,
+            help="Maximum number of concurrent requests per course"
+        )
+
+    def handle(self, *args, **options):
+        self.stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: self.stopped.set())
+        signal.signal(signal.SIGINT, lambda *args: self.stopped.set())
+
+        try:
+            with single_instance_lock(settings.GRADING_DAEMON_LOCK_FILE):
+                self.run(options["workers"], options["per_course"])
+        except AlreadyRunning as e:
+            raise CommandError(f"Grading daemon is already running: {e}")
+
+    def run(self, workers, per_course):
+        scheduler = PollScheduler(settings.POLL_MIN_INTERVAL,
+                                  settings.POLL_MAX_INTERVAL,
+                                  settings.POLL_DEADLINE_WINDOW)
+        limits = {}
+        exercises = {}
+        next_rescan = 0
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while not self.stopped.is_set():
+                now = time.monotonic()
+
+                if now >= next_rescan:
+                    try:
+                        exercises = {
+                            exercise.pk: exercise
+                            for exercise in Exercise.objects.filter(
+                                in_grading=True, stop_polling=False
+                            ).select_related("course__base_course")
+                        }
+                        scheduler.sync(exercises, now)
+                    except DatabaseError as e:
+                        LOGGER.debug(e)
+                        connection.close()
+
+                    next_rescan = now + settings.POLL_RESCAN_INTERVAL
+
+                due = [exercises[pk] for pk in scheduler.due(now)]
+
+                if due:
+                    self.poll(executor, due, limits, per_course, scheduler)
+                    continue
+
+                next_poll = scheduler.next_time() or next_rescan
+                self.stopped.wait(max(min(next_poll, next_rescan) - now, 0))
+
+    def poll(self, executor, exercises, limits, per_course, scheduler):
+        """
+        Poll the exercises and schedule their next polls.
+        :param executor: (ThreadPoolExecutor) worker threads
+        :param exercises: (list) Exercise objects to poll
+        :param limits: (dict) Course id: BoundedSemaphore
+        :param per_course: (int) concurrent requests per course
+        :param scheduler: (PollScheduler) polling schedule
+        """
+        for exercise, changed, closing_time in poll_exercises(
+                executor, exercises, limits, per_course):
+            until_closing = None
+
+            if closing_time is not None:
+                until_closing = \
+                    (closing_time - timezone.now()).total_seconds()
+
+            scheduler.reschedule(exercise.pk, time.monotonic(), changed,
+                                 until_closing)
@@ -0,0 +1,50 @@
+"""
+Management command to run the background jobs queued by the views. This is
+ment to be run as a service. With --burst it exits when the queue is empty,
+so it can also be called frequently by crontab.
+
+Several workers can be run at the same time, a job is claimed by one of
+them only. Jobs left running by a killed worker are queued again by the
+other workers, see submissions.jobs.reap_jobs. On SIGTERM the worker
+finishes the current job before exiting.
+"""
+
+import logging
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from submissions.jobs import claim_job, reap_jobs, run_job
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--burst", action="store_true",
+            help="Exit when there are no queued jobs left"
+        )
+
+    def handle(self, *args, **options):
+        stopped = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+        signal.signal(signal.SIGINT, lambda *args: stopped.set())
+
+        while not stopped.is_set():
+            close_old_connections()
+            reap_jobs()
+            job = claim_job()
+
+            if job is not None:
+                LOGGER.debug(f"Running job {job.pk}: {job}")
+                run_job(job)
+            elif options["burst"]:
+                return
+            else:
+                stopped.wait(settings.JOB_POLL_INTERVAL)
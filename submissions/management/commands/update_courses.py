@@ -1,30 +1,145 @@
 """
-Management command to get new submissions from Plussa. This is ment to be
-called frequently by crontab.
+Management command to update the course details and exercises from Plussa.
+This is ment to be called frequently by crontab.
+
+With --workers N several courses are updated concurrently, at most
+--per-host at a time from the same Plussa server. No new courses are
+started after --budget seconds, so that the runs don't overlap. A result
+summary of every course is printed at the end.
 """
 
 import logging
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.core.management.base import BaseCommand
+from django.db import connection
 from submissions.models import Course
 from submissions.utils import update_course_details, get_exercises
+from urllib.parse import urlsplit
 
 
 LOGGER = logging.getLogger(__name__)
 
+OK = "ok"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+SKIPPED = "skipped"
+
 
 class Command(BaseCommand):
+    help = "Update the details and exercises of the courses from Plussa."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=1,
+            help="Number of courses updated concurrently"
+        )
+        parser.add_argument(
+            "--per-host", type=int, default=2,
+            help="Maximum number of courses updated concurrently "
+                 "from the same Plussa server"
+        )
+        parser.add_argument(
+            "--budget", type=float, default=0,
+            help="Don't start updating new courses after this many "
+                 "seconds, 0 for no limit"
+        )
+
     def handle(self, *args, **options):
-        courses = Course.objects.values_list("id", flat=True)
-
-        for pk in courses:
-            try:
-                # Retrieve and update if query matching course exists
-                course = Course.objects.get(id=pk, archived=False)
-                update_course_details(course)
-                get_exercises(course)
-            except Course.DoesNotExist:
-                continue
-            except Exception as e:
-                LOGGER.debug(e)
-                continue
+        started = time.monotonic()
+        deadline = None
+
+        if options["budget"] > 0:
+            deadline = started + options["budget"]
+
+        courses = list(Course.objects.filter(archived=False))
+        limits = {
+            urlsplit(course.api_url).netloc:
+                threading.BoundedSemaphore(max(options["per_host"], 1))
+            for course in courses
+        }
+        results = {}
+
+        if options["workers"] > 1:
+            with ThreadPoolExecutor(
+                    max_workers=options["workers"]) as executor:
+                futures = {
+                    executor.submit(
+                        refresh_in_thread, course,
+                        limits[urlsplit(course.api_url).netloc], deadline
+                    ): course for course in courses
+                }
+
+                for future in as_completed(futures):
+                    results[futures[future].pk] = future.result()
+        else:
+            for course in courses:
+                results[course.pk] = refresh_course(
+                    course, limits[urlsplit(course.api_url).netloc],
+                    deadline
+                )
+
+        self.report(courses, results, time.monotonic() - started)
+
+    def report(self, courses, results, duration):
+        """
+        Print the result of every course and the totals.
+        :param courses: (list) updated Course objects
+        :param results: (dict) Course id: result of refresh_course
+        :param duration: (float) duration of the whole run in seconds
+        """
+        totals = {OK: 0, UNCHANGED: 0, FAILED: 0, SKIPPED: 0}
+
+        for course in courses:
+            result, course_duration, error = results[course.pk]
+            totals[result] += 1
+            line = f"{course}: {result} {course_duration:.1f}s"
+
+            if error:
+                line = f"{line} {error}"
+
+            self.stdout.write(line)
+
+        self.stdout.write(
+            f"{len(courses)} courses in {duration:.1f}s: "
+            + ", ".join(f"{count} {result}"
+                        for result, count in totals.items())
+        )
+
+
+def refresh_course(course, limit, deadline):
+    """
+    Update the course details and exercises of one course.
+    :param course: (Course) model object
+    :param limit: (BoundedSemaphore) concurrency limit of the Plussa server
+    :param deadline: (float) time.monotonic() after which the course is
+                     skipped, or None
+    :return: (tuple) result, duration in seconds, error message
+    """
+    with limit:
+        if deadline is not None and time.monotonic() > deadline:
+            return SKIPPED, 0.0, ""
+
+        started = time.monotonic()
+
+        try:
+            changed = update_course_details(course)
+            changed = get_exercises(course) or changed
+        except Exception as e:
+            LOGGER.debug(e)
+            return FAILED, time.monotonic() - started, str(e)
+
+        return OK if changed else UNCHANGED, time.monotonic() - started, ""
+
+
+def refresh_in_thread(course, limit, deadline):
+    """
+    Run refresh_course in a worker thread and close the database
+    connection of the thread afterwards.
+    """
+    try:
+        return refresh_course(course, limit, deadline)
+    finally:
+        connection.close()
@@ -1,12 +1,21 @@
 """
 Management command to get new submissions from Plussa. This is ment to be
-called frequently by crontab.
+called frequently by crontab. Nothing is done if another run or the
+grading daemon is already running.
+
+With --workers N the submission data of several exercises is fetched from
+Plussa concurrently. Database updates are still done one exercise at a time
+in the main thread, each in its own transaction.
 """
 
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from submissions.models import Exercise
+from submissions.scheduler import (AlreadyRunning, poll_exercises,
+                                   single_instance_lock)
 from submissions.utils import update_submissions
 
 
@@ -14,7 +23,32 @@ LOGGER = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
+    help = "Get new submissions of the exercises in grading from Plussa."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=1,
+            help="Number of exercises fetched from Plussa concurrently"
+        )
+        parser.add_argument(
+            "--per-course", type=int, default=2,
+            help="Maximum number of concurrent requests per course"
+        )
+
     def handle(self, *args, **options):
+        # Overlapping runs and the grading daemon would do the same work
+        try:
+            with single_instance_lock(settings.GRADING_DAEMON_LOCK_FILE):
+                self.update(options)
+        except AlreadyRunning as e:
+            LOGGER.debug(e)
+
+    def update(self, options):
+        if options["workers"] > 1:
+            self.update_concurrently(options["workers"],
+                                     options["per_course"])
+            return
+
         exercises = Exercise.objects.values_list("id", flat=True)
 
         for pk in exercises:
@@ -31,3 +65,13 @@ class Command(BaseCommand):
             except Exception as e:
                 LOGGER.debug(e)
                 continue
+
+    def update_concurrently(self, workers, per_course):
+        exercises = list(Exercise.objects.filter(
+            in_grading=True, stop_polling=False
+        ).select_related("course__base_course"))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for exercise, changed, _ in poll_exercises(executor, exercises,
+                                                       {}, per_course):
+                LOGGER.debug(f"{exercise}: changed {changed}")
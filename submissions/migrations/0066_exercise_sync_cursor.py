@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0065_auto_20250113_1534'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercise',
+            name='sync_cursor',
+            field=models.CharField(default=None, max_length=64, null=True),
+        ),
+    ]
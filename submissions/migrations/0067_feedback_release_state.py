@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0066_exercise_sync_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feedback',
+            name='release_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='feedback',
+            name='release_state',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Not queued'), (1, 'Queued'), (2, 'Sending'), (3, 'Failed')], default=0),
+        ),
+    ]
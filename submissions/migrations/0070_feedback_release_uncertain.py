@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0069_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='feedback',
+            name='release_state',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Not queued'), (1, 'Queued'), (2, 'Sending'), (3, 'Failed'), (4, 'Unknown')], default=0),
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import AbstractUser
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.utils.functional import cached_property
+import json
 import os
 
 
@@ -15,6 +17,28 @@ class User(AbstractUser):
     def __str__(self):
         return self.email
 
+    @cached_property
+    def teacher_course_ids(self):
+        """
+        Ids of the BaseCourses where the user is a teacher. Loaded once per
+        User object, which in views means once per request.
+        """
+        return set(self.courses_teacher.values_list("id", flat=True))
+
+    @cached_property
+    def assistant_course_ids(self):
+        """
+        Ids of the BaseCourses where the user is an assistant.
+        """
+        return set(self.courses_assistant.values_list("id", flat=True))
+
+    def clear_course_roles(self):
+        """
+        Forget the loaded course memberships after they have been changed.
+        """
+        self.__dict__.pop("teacher_course_ids", None)
+        self.__dict__.pop("assistant_course_ids", None)
+
 
 class BaseCourse(BigAutoIDModel):
     label = models.CharField(max_length=255)
@@ -48,14 +72,12 @@ class Course(BigAutoIDModel):
         return self.name
         
     def is_teacher(self, user):
-        return user.is_superuser or self.base_course.teachers.filter(
-            id=user.id
-        ).exists()
+        return user.is_superuser or \
+            self.base_course_id in user.teacher_course_ids
 
     def is_staff(self, user):
-        return self.is_teacher(user) or self.base_course.assistants.filter(
-            id=user.id
-        ).exists()
+        return self.is_teacher(user) or \
+            self.base_course_id in user.assistant_course_ids
 
 
 def feedback_base_path(instance, filename):
@@ -101,6 +123,10 @@ class Exercise(BigAutoIDModel):
     stop_polling = models.BooleanField(default=False)
     error_state = models.CharField(max_length=255, default=None, null=True)
 
+    # Hash of the submission data handled by the latest update.
+    # Polling is short-circuited if nothing has changed since.
+    sync_cursor = models.CharField(max_length=64, default=None, null=True)
+
     # Mahdollisuus valita tehtävien automaattinen jako assareille.
     # auto_div=False => assari valitsee itse tehtävät tarkastukseen.
     work_div = models.PositiveSmallIntegerField(choices=DIV_CHOICES,
@@ -128,6 +154,7 @@ class Exercise(BigAutoIDModel):
         self.work_div = self.EVEN_DIV
         self.graders.all = None
         self.num_of_graders = None
+        self.sync_cursor = None
 
 
 class Student(BigAutoIDModel):
@@ -147,6 +174,17 @@ class Student(BigAutoIDModel):
             return self.email
 
 
+class FeedbackQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Load the related objects shown in feedback listings up front, so
+        that the number of queries doesn't grow with the list.
+        """
+        return self.select_related(
+            "exercise", "grader"
+        ).prefetch_related("students")
+
+
 class Feedback(BigAutoIDModel):
     BASE = 0
     DRAFT = 1
@@ -157,6 +195,23 @@ class Feedback(BigAutoIDModel):
         (DRAFT, "Draft"),
         (READY, "Ready"),
     )
+
+    # Release state is kept while the feedback is being posted to Plussa.
+    # An UNCERTAIN feedback may or may not have reached Plussa, so it is
+    # never posted again automatically.
+    NOT_QUEUED = 0
+    QUEUED = 1
+    SENDING = 2
+    FAILED = 3
+    UNCERTAIN = 4
+
+    RELEASE_CHOICES = (
+        (NOT_QUEUED, "Not queued"),
+        (QUEUED, "Queued"),
+        (SENDING, "Sending"),
+        (FAILED, "Failed"),
+        (UNCERTAIN, "Unknown"),
+    )
     
     exercise = models.ForeignKey(Exercise, on_delete=models.CASCADE)
     sub_id = models.BigIntegerField(unique=True)
@@ -172,6 +227,11 @@ class Feedback(BigAutoIDModel):
     status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES,
                                               default=BASE)
     released = models.BooleanField(default=False)
+    release_state = models.PositiveSmallIntegerField(choices=RELEASE_CHOICES,
+                                                     default=NOT_QUEUED)
+    release_error = models.TextField(blank=True)
+
+    objects = FeedbackQuerySet.as_manager()
 
     class Meta:
         ordering = ["status", "released", "sub_id"]
@@ -181,3 +241,90 @@ class Feedback(BigAutoIDModel):
 
     def get_students(self):
         return self.students.all()
+
+
+class JobQuerySet(models.QuerySet):
+    def enqueue(self, kind, user=None, **args):
+        """
+        Add a job to the queue. If the same job is already waiting in the
+        queue, it is returned instead of adding a new one.
+        :param kind: (str) name of the job handler
+        :param user: (User) user who started the job
+        :param args: arguments of the handler, must be json serializable
+        :return: (Job) model object
+        """
+        key = f"{kind}:{json.dumps(args, sort_keys=True)}"
+
+        while True:
+            try:
+                with transaction.atomic():
+                    return self.create(kind=kind, key=key, args=args,
+                                       user=user)
+            except IntegrityError:
+                job = self.filter(key=key, status=Job.QUEUED).first()
+
+                # Otherwise the queued job was just started, try again
+                if job is not None:
+                    return job
+
+
+class Job(BigAutoIDModel):
+    """
+    Long-running operation run by the run_jobs management command
+    instead of the web request which started it.
+    """
+    QUEUED = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+
+    STATUS_CHOICES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    kind = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    args = JSONField(default=dict)
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES,
+                                              default=QUEUED)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL,
+                             null=True, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    # Updated by the worker while the job is running, see jobs.reap_jobs
+    heartbeat = models.DateTimeField(null=True)
+
+    objects = JobQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["created"]
+        constraints = [
+            # The same job is queued only once
+            models.UniqueConstraint(fields=["key"],
+                                    condition=models.Q(status=0),
+                                    name="unique_queued_job"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.args}"
+
+    def get_course(self):
+        """
+        Return the course the job is run for.
+        :return: (Course) model object or None
+        """
+        if "course_id" in self.args:
+            return Course.objects.filter(pk=self.args["course_id"]).first()
+
+        if "exercise_id" in self.args:
+            exercise = Exercise.objects.select_related("course").filter(
+                pk=self.args["exercise_id"]
+            ).first()
+            return exercise.course if exercise else None
+
+        return None
@@ -0,0 +1,156 @@
+"""
+Background prefetch of submissions for the feedback view. When a grader
+opens a submission, the data of the next submissions on their grading list
+is fetched in a bounded thread pool. The files end up in the render cache
+and the A+ responses in the aplus cache, so opening the next submission
+doesn't have to wait for Plussa.
+
+Pending prefetches are kept per grader and cancelled when the grader moves
+to another exercise or leaves the grading views.
+"""
+
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from django.conf import settings
+
+from .models import Feedback
+from .utils import fetch_submission_data
+
+
+prefetch_logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def prefetch_next(user, feedback):
+    """
+    Start prefetching the submissions following the given feedback on the
+    user's grading list. Prefetches of the user's other submissions which
+    haven't started yet are cancelled.
+    :param user: (User) grader
+    :param feedback: (Feedback) currently opened feedback
+    """
+    if settings.PREFETCH_COUNT < 1:
+        return
+
+    exercise = feedback.exercise
+
+    # Same order as in the grading list
+    sub_ids = list(Feedback.objects.filter(
+        exercise=exercise, grader=user
+    ).values_list("sub_id", flat=True))
+
+    try:
+        position = sub_ids.index(feedback.sub_id)
+    except ValueError:
+        cancel_prefetch(user)
+        return
+
+    next_ids = sub_ids[position + 1:position + 1 + settings.PREFETCH_COUNT]
+    course = exercise.course
+    executor = get_executor()
+
+    with _lock:
+        exercise_id, futures = _pending.get(user.pk, (None, {}))
+
+        if exercise_id != exercise.pk:
+            futures = cancel_futures(futures, [])
+        else:
+            futures = cancel_futures(futures, next_ids)
+
+        for sub_id in next_ids:
+            if sub_id not in futures:
+                futures[sub_id] = executor.submit(
+                    prefetch_submission, exercise.api_url, course.api_root,
+                    course.api_token, sub_id
+                )
+
+        _pending[user.pk] = (exercise.pk, futures)
+
+
+def wait_for_prefetch(user, sub_id):
+    """
+    If the submission is being prefetched for the user, wait until it is
+    done so that the data isn't fetched twice at the same time.
+    :param user: (User) grader
+    :param sub_id: (int) submission id
+    """
+    with _lock:
+        exercise_id, futures = _pending.get(user.pk, (None, {}))
+        future = futures.pop(sub_id, None)
+
+    if future is None or future.cancel():
+        return
+
+    try:
+        future.result(timeout=settings.PREFETCH_WAIT_TIMEOUT)
+    except TimeoutError:
+        prefetch_logger.debug(f"Prefetch of submission {sub_id} timed out")
+
+
+def cancel_prefetch(user, keep_exercise=None):
+    """
+    Cancel the user's prefetches which haven't started yet.
+    :param user: (User) grader
+    :param keep_exercise: (int) don't cancel if prefetching this exercise
+    """
+    with _lock:
+        exercise_id, futures = _pending.get(user.pk, (None, {}))
+
+        if exercise_id is None or exercise_id == keep_exercise:
+            return
+
+        del _pending[user.pk]
+        cancel_futures(futures, [])
+
+
+def cancel_futures(futures, keep):
+    """
+    Cancel the futures of the submissions not in keep. Finished futures
+    in keep are kept too, so the submissions aren't fetched again.
+    Must be called holding _lock.
+    :param futures: (dict) submission id: Future
+    :param keep: (list) submission ids to keep
+    :return: (dict) remaining futures
+    """
+    remaining = {}
+
+    for sub_id, future in futures.items():
+        if sub_id in keep:
+            remaining[sub_id] = future
+        else:
+            future.cancel()
+
+    return remaining
+
+
+def prefetch_submission(exercise_url, api_root, api_token, sub_id):
+    """
+    Fetch the submission data to warm the caches. Runs in a worker thread.
+    Errors are only logged, the feedback view will try again.
+    """
+    try:
+        fetch_submission_data(exercise_url, api_root, api_token, sub_id)
+    except Exception as e:
+        prefetch_logger.debug(f"Prefetch of submission {sub_id} failed: {e}")
+
+
+def get_executor():
+    """
+    Return the shared thread pool, created on the first call.
+    :return: (ThreadPoolExecutor)
+    """
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PREFETCH_WORKERS,
+                thread_name_prefix="prefetch"
+            )
+
+    return _executor
@@ -10,10 +10,13 @@ from django.contrib.auth.signals import user_logged_in
 from django.contrib import messages
 from django.core.exceptions import PermissionDenied
 from django.shortcuts import reverse
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django_lti_login.signals import lti_login_authenticated
 
-from .utils import add_user_to_course
+from .models import BaseCourse, Feedback
+from .utils import (add_user_to_course, invalidate_feedback_counts,
+                    invalidate_staff_choices)
 
 
 logger = logging.getLogger(__name__)
@@ -79,3 +82,34 @@ def store_course_info(sender, **kwargs):
             logger.debug("LTI login accepted for user %s", user)
             for k, v in sorted(oauth.params):
                 print("  \w param -- %s: %s", k, v)
+
+
+@receiver(post_save, sender=Feedback)
+@receiver(post_delete, sender=Feedback)
+def feedback_changed(sender, instance, **kwargs):
+    """
+    Feedback counters of the exercise are out of date after any change.
+    """
+    invalidate_feedback_counts(instance.exercise_id)
+
+
+@receiver(m2m_changed, sender=BaseCourse.teachers.through)
+@receiver(m2m_changed, sender=BaseCourse.assistants.through)
+def course_staff_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Grader choices of the course are out of date after staff changes.
+    """
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    if not reverse:
+        base_courses = [instance.pk]
+    elif pk_set:
+        base_courses = pk_set
+    else:
+        base_courses = sender.objects.filter(
+            user=instance.pk
+        ).values_list("basecourse_id", flat=True)
+
+    for base_course_id in base_courses:
+        invalidate_staff_choices(base_course_id)
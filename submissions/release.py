@@ -0,0 +1,266 @@
+"""
+Release engine that posts feedbacks to Plussa outside the request cycle.
+
+Feedbacks to be released are marked QUEUED and a release job of the
+exercise posts them with bounded concurrency. Every feedback is marked
+SENDING before its POST and released after a successful one.
+
+Errors which mean that Plussa didn't handle the request (429, 503 and
+failed connection attempts) are retried with backoff and then mark the
+feedback FAILED so that it can be queued again. After other errors (500,
+502, 504, read timeouts and lost connections) Plussa may already have the
+feedback, so it is marked UNCERTAIN and never posted again automatically.
+A teacher checks it from Plussa and either queues it again or marks it
+released. A feedback left SENDING by an interrupted run is UNCERTAIN too.
+"""
+
+import logging
+import requests
+import time
+import urllib3
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .aplus import get_client
+from .models import Exercise, Feedback, Job
+from .utils import create_json_object, invalidate_feedback_counts
+
+
+release_logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (429, 503)
+UNCERTAIN_STATUS_CODES = (500, 502, 504)
+
+
+def queue_release(exercise, user):
+    """
+    Queue the user's READY feedbacks of the exercise for release. Feedbacks
+    which failed earlier are queued again. The release job of the exercise
+    is queued whenever the exercise has queued feedbacks, so that a release
+    interrupted earlier is resumed too.
+    :param exercise: (Exercise) model object
+    :param user: (User) grader
+    :return: (int) number of the user's feedbacks in the queue
+    """
+    with transaction.atomic():
+        exercise.feedback_set.filter(
+            grader=user,
+            status=Feedback.READY,
+            released=False,
+            release_state__in=[Feedback.NOT_QUEUED, Feedback.FAILED]
+        ).update(release_state=Feedback.QUEUED, release_error="")
+
+        queued = exercise.feedback_set.filter(release_state=Feedback.QUEUED)
+
+        if queued.exists():
+            Job.objects.enqueue("release", user=user,
+                                exercise_id=exercise.pk)
+
+        return queued.filter(grader=user).count()
+
+
+def resolve_uncertain(exercise, user, feedback_ids, released):
+    """
+    Resolve feedbacks whose release outcome is unknown after the teacher
+    has checked them from Plussa.
+    :param exercise: (Exercise) model object
+    :param user: (User) teacher
+    :param feedback_ids: (list) Feedback ids
+    :param released: (bool) True if the feedbacks were found in Plussa,
+                     False to post them again
+    :return: (int) number of resolved feedbacks
+    """
+    feedbacks = exercise.feedback_set.filter(
+        id__in=feedback_ids, release_state=Feedback.UNCERTAIN
+    )
+
+    with transaction.atomic():
+        if released:
+            count = feedbacks.update(released=True,
+                                     release_state=Feedback.NOT_QUEUED,
+                                     release_error="")
+        else:
+            count = feedbacks.update(release_state=Feedback.QUEUED,
+                                     release_error="")
+            if count:
+                Job.objects.enqueue("release", user=user,
+                                    exercise_id=exercise.pk)
+
+    invalidate_feedback_counts(exercise.pk)
+    return count
+
+
+def get_release_status(exercise, user):
+    """
+    Count the user's feedbacks of the exercise by release state.
+    :param exercise: (Exercise) model object
+    :param user: (User) grader
+    :return: (dict) counts and the errors of the failed feedbacks
+    """
+    feedbacks = exercise.feedback_set.filter(grader=user).order_by()
+    status = feedbacks.aggregate(
+        released=Count("id", filter=Q(released=True)),
+        queued=Count("id", filter=Q(release_state=Feedback.QUEUED)),
+        sending=Count("id", filter=Q(release_state=Feedback.SENDING)),
+        failed=Count("id", filter=Q(release_state=Feedback.FAILED)),
+        uncertain=Count("id", filter=Q(release_state=Feedback.UNCERTAIN)),
+    )
+    status["running"] = Job.objects.filter(
+        kind="release",
+        args__exercise_id=exercise.pk,
+        status__in=[Job.QUEUED, Job.RUNNING]
+    ).exists()
+    status["errors"] = dict(
+        feedbacks.filter(
+            release_state__in=[Feedback.FAILED, Feedback.UNCERTAIN]
+        ).values_list("sub_id", "release_error")
+    )
+
+    return status
+
+
+def release_queued(exercise_id):
+    """
+    Post the queued feedbacks of the exercise until none are left.
+    Handler of the release job. Release jobs of the same exercise don't
+    run at the same time, so feedbacks left SENDING belong to an
+    interrupted run.
+    :param exercise_id: (int) Exercise id
+    """
+    exercise = Exercise.objects.select_related("course").get(pk=exercise_id)
+    exercise.feedback_set.filter(release_state=Feedback.SENDING).update(
+        release_state=Feedback.UNCERTAIN,
+        release_error="Release was interrupted, check the feedback in Plussa"
+    )
+    url = f"{exercise.api_url}/submissions/"
+    client = get_client(exercise.course.api_token)
+
+    with ThreadPoolExecutor(max_workers=settings.RELEASE_WORKERS) as executor:
+        while True:
+            feedbacks = claim_feedbacks(exercise)
+
+            if not feedbacks:
+                return
+
+            payloads = [create_json_object(fb) for fb in feedbacks]
+            results = executor.map(
+                lambda payload: post_feedback(client, url, payload),
+                payloads
+            )
+
+            for feedback, result in zip(feedbacks, results):
+                save_result(feedback, *result)
+
+            invalidate_feedback_counts(exercise_id)
+
+
+def claim_feedbacks(exercise):
+    """
+    Mark the next batch of queued feedbacks SENDING. Rows locked by
+    another process releasing the same exercise are skipped.
+    :param exercise: (Exercise) model object
+    :return: (list) Feedback objects to post
+    """
+    with transaction.atomic():
+        ids = list(
+            exercise.feedback_set.filter(release_state=Feedback.QUEUED)
+            .order_by("sub_id")
+            .select_for_update(skip_locked=True)
+            .values_list("id", flat=True)[:settings.RELEASE_BATCH_SIZE]
+        )
+        Feedback.objects.filter(id__in=ids).update(
+            release_state=Feedback.SENDING
+        )
+
+    return list(
+        Feedback.objects.filter(id__in=ids).order_by("sub_id")
+        .select_related("exercise", "grader").prefetch_related("students")
+    )
+
+
+def post_feedback(client, url, payload):
+    """
+    POST one feedback to Plussa. Requests which Plussa didn't handle are
+    retried with exponential backoff, honoring the Retry-After header.
+    :param client: (APlusClient) client of the course
+    :param url: (str) submissions url of the exercise
+    :param payload: (dict) result of create_json_object
+    :return: (tuple) release state, error message
+    """
+    for attempt in range(settings.RELEASE_RETRIES + 1):
+        retry = attempt < settings.RELEASE_RETRIES
+        delay = min(settings.RELEASE_BACKOFF * 2 ** attempt,
+                    settings.RELEASE_MAX_BACKOFF)
+
+        try:
+            resp = client.post(url, json=payload)
+        except requests.RequestException as e:
+            if was_sent(e):
+                # Plussa may have received the feedback
+                return Feedback.UNCERTAIN, str(e)
+            if retry:
+                time.sleep(delay)
+                continue
+            return Feedback.FAILED, str(e)
+
+        if resp.status_code == requests.codes.created:
+            return Feedback.NOT_QUEUED, ""
+
+        if resp.status_code in RETRY_STATUS_CODES and retry:
+            time.sleep(get_retry_after(resp, delay))
+            continue
+
+        if resp.status_code in UNCERTAIN_STATUS_CODES:
+            return Feedback.UNCERTAIN, f"{resp.status_code} {resp.text}"
+
+        return Feedback.FAILED, f"{resp.status_code} {resp.text}"
+
+
+def was_sent(error):
+    """
+    :param error: (requests.RequestException) error of a request
+    :return: (bool) False if the request certainly never reached Plussa
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return False
+
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # Refused connections and failed name lookups
+        reason = getattr(error.args[0], "reason", None)
+        return not isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+    return True
+
+
+def get_retry_after(resp, default):
+    """
+    :param resp: (requests.Response)
+    :param default: (int) delay used if Retry-After is missing
+    :return: (int) seconds to wait before retrying
+    """
+    try:
+        delay = int(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return default
+
+    return min(max(delay, 0), settings.RELEASE_MAX_BACKOFF)
+
+
+def save_result(feedback, state, error):
+    """
+    :param feedback: (Feedback) posted feedback
+    :param state: (int) release state returned by post_feedback
+    :param error: (str) error message
+    """
+    if state == Feedback.NOT_QUEUED:
+        Feedback.objects.filter(pk=feedback.pk).update(
+            released=True, release_state=state, release_error=""
+        )
+    else:
+        release_logger.debug(f"Release of {feedback.sub_id} failed: {error}")
+        Feedback.objects.filter(pk=feedback.pk).update(
+            release_state=state, release_error=error
+        )
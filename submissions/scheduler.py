@@ -0,0 +1,231 @@
+"""
+Polling of the submissions, shared by the update_submissions and
+grading_daemon management commands.
+
+Submissions of several exercises are fetched from Plussa concurrently and
+updated to the database one exercise at a time in the calling thread.
+
+In the grading daemon every exercise in grading is polled on its own
+interval: the interval is doubled every time nothing has changed and reset
+when new submissions are found. Around the closing time of the exercise
+module the exercise is polled at the shortest interval.
+"""
+
+import fcntl
+import heapq
+import logging
+import requests
+import threading
+
+from concurrent.futures import as_completed
+from contextlib import contextmanager
+from django.db import DatabaseError, connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from .utils import (check_deadline, fetch_submissions, get_module_state,
+                    update_submissions)
+
+
+scheduler_logger = logging.getLogger(__name__)
+
+
+class AlreadyRunning(Exception):
+    pass
+
+
+@contextmanager
+def single_instance_lock(path):
+    """
+    Hold an exclusive lock on the file while the block is run. The lock is
+    released by the operating system even if the process is killed.
+    :param path: (str) lock file path
+    :raises AlreadyRunning: if another process holds the lock
+    """
+    with open(path, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise AlreadyRunning(f"{path} is locked by another process")
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class PollScheduler:
+    """
+    Next poll time and the current interval of every exercise. Times are
+    in seconds, as returned by time.monotonic().
+    """
+
+    def __init__(self, min_interval, max_interval, deadline_window):
+        """
+        :param min_interval: (float) shortest interval
+        :param max_interval: (float) longest interval of a quiet exercise
+        :param deadline_window: (float) exercise is polled at the shortest
+                                interval this long before and after the
+                                closing time
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.deadline_window = deadline_window
+        self.intervals = {}
+        self.next_polls = {}
+        self.heap = []
+
+    def sync(self, exercise_ids, now):
+        """
+        Start polling the new exercises immediately and forget the
+        exercises which are no longer polled.
+        :param exercise_ids: (iterable) ids of the exercises to poll
+        :param now: (float) current time
+        """
+        exercise_ids = set(exercise_ids)
+
+        for exercise_id in exercise_ids - self.next_polls.keys():
+            self.intervals[exercise_id] = self.min_interval
+            self.schedule(exercise_id, now)
+
+        for exercise_id in self.next_polls.keys() - exercise_ids:
+            del self.intervals[exercise_id]
+            del self.next_polls[exercise_id]
+
+    def schedule(self, exercise_id, poll_time):
+        self.next_polls[exercise_id] = poll_time
+        heapq.heappush(self.heap, (poll_time, exercise_id))
+
+    def due(self, now):
+        """
+        :param now: (float) current time
+        :return: (list) ids of the exercises to poll now
+        """
+        exercise_ids = []
+
+        while self.heap and self.heap[0][0] <= now:
+            poll_time, exercise_id = heapq.heappop(self.heap)
+
+            # Entries of forgotten or rescheduled exercises are stale
+            if self.next_polls.get(exercise_id) == poll_time:
+                exercise_ids.append(exercise_id)
+
+        return exercise_ids
+
+    def next_time(self):
+        """
+        :return: (float) time of the next poll or None if nothing is polled
+        """
+        while self.heap:
+            poll_time, exercise_id = self.heap[0]
+
+            if self.next_polls.get(exercise_id) == poll_time:
+                return poll_time
+
+            heapq.heappop(self.heap)
+
+        return None
+
+    def reschedule(self, exercise_id, now, changed, until_closing=None):
+        """
+        Schedule the next poll of a polled exercise.
+        :param exercise_id: (int) Exercise id
+        :param now: (float) current time
+        :param changed: (bool) True if the poll found new submissions
+        :param until_closing: (float) seconds to the closing time of the
+                              exercise module, negative if it has passed
+        """
+        if exercise_id not in self.intervals:
+            return
+
+        if changed:
+            interval = self.min_interval
+        else:
+            interval = min(self.intervals[exercise_id] * 2,
+                           self.max_interval)
+
+        self.intervals[exercise_id] = interval
+
+        if until_closing is not None:
+            if abs(until_closing) < self.deadline_window:
+                interval = self.min_interval
+            elif until_closing > 0:
+                # Don't sleep over the busy time around the deadline
+                interval = min(interval,
+                               until_closing - self.deadline_window)
+
+        self.schedule(exercise_id, now + interval)
+
+
+def poll_exercises(executor, exercises, limits, per_course):
+    """
+    Fetch the submissions of the exercises concurrently and update them to
+    the database one at a time in this thread, each in its own transaction.
+    Settings of the exercise are read again before updating, because a
+    teacher may have changed them while fetching. Errors are logged and
+    Plussa errors are saved to the exercise.
+    :param executor: (ThreadPoolExecutor) worker threads
+    :param exercises: (list) Exercise objects with course already loaded
+    :param limits: (dict) Course id: BoundedSemaphore, missing courses
+                   are added
+    :param per_course: (int) concurrent requests per course
+    :return: (generator) Exercise, True if new submissions were found and
+             module closing time or None, in the order of completion
+    """
+    futures = {}
+
+    for exercise in exercises:
+        # One semaphore per course limits the load caused to Plussa
+        # by a single course with a lot of exercises in grading.
+        limit = limits.setdefault(
+            exercise.course_id,
+            threading.BoundedSemaphore(max(per_course, 1))
+        )
+        futures[executor.submit(fetch_exercise, exercise, limit)] = exercise
+
+    for future in as_completed(futures):
+        exercise = futures[future]
+        changed = False
+        closing_time = None
+
+        try:
+            fetched, closing_time = future.result()
+
+            with transaction.atomic():
+                exercise.refresh_from_db()
+                if exercise.in_grading and not exercise.stop_polling:
+                    changed = update_submissions(exercise, fetched)
+
+        except requests.RequestException as e:
+            scheduler_logger.debug(e)
+            try:
+                exercise.error_state = e
+                exercise.save(update_fields=["error_state"])
+            except DatabaseError:
+                connection.close()
+        except DatabaseError as e:
+            scheduler_logger.debug(e)
+            connection.close()
+        except Exception as e:
+            scheduler_logger.debug(e)
+
+        yield exercise, changed, closing_time
+
+
+def fetch_exercise(exercise, limit):
+    """
+    Fetch and sort the submissions of the exercise and the closing time of
+    its module. Runs in a worker thread and doesn't touch the database.
+    :param exercise: (Exercise) model object with course already loaded
+    :param limit: (BoundedSemaphore) concurrency limit of the course
+    :return: (tuple) result of fetch_submissions, module closing time
+    """
+    with limit:
+        module = get_module_state(exercise)
+        fetched = fetch_submissions(exercise, check_deadline(exercise, module))
+
+    closing_time = None
+
+    if module["closing_time"]:
+        closing_time = parse_datetime(module["closing_time"])
+
+    return fetched, closing_time
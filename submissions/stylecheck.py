@@ -0,0 +1,154 @@
+"""
+PEP8 style check for submitted Python files. Results are collected with
+a custom pycodestyle report instead of capturing sys.stdout, so checks can
+run concurrently. Checks are run in a bounded process pool, which keeps
+large files from blocking the threads serving other requests.
+"""
+
+import logging
+import multiprocessing
+import pycodestyle
+import re
+import threading
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+
+
+style_logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class CollectReport(pycodestyle.BaseReport):
+    """
+    Collect the results of the checks as a list instead of printing them.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self._repeat = options.repeat
+        self.diagnostics = []
+
+    def error(self, line_number, offset, text, check):
+        code = super().error(line_number, offset, text, check)
+
+        if code and (self.counters[code] == 1 or self._repeat):
+            self.diagnostics.append({
+                "line": self.line_offset + line_number,
+                "column": offset + 1,
+                "code": code,
+                "text": text[5:],
+            })
+
+        return code
+
+
+def check_style(content):
+    """
+    Run the style check for the file content.
+    :param content: (str) Python source code
+    :return: (list) diagnostics as dicts in the order pycodestyle prints them
+    """
+    lines = content.rstrip("\n").split("\n")
+    lines = [line + "\n" for line in lines]
+
+    guide = pycodestyle.StyleGuide(reporter=CollectReport)
+    checker = pycodestyle.Checker(lines=lines, options=guide.options)
+    checker.check_all()
+
+    return sorted(
+        checker.report.diagnostics,
+        key=lambda d: (d["line"], d["column"], d["code"], d["text"])
+    )
+
+
+def format_report(content, diagnostics):
+    """
+    Format the diagnostics like pycodestyle prints them with show_source.
+    :param content: (str) checked source code
+    :param diagnostics: (list) result of check_style
+    :return: (str) report text
+    """
+    lines = content.rstrip("\n").split("\n")
+    report = []
+
+    for diagnostic in diagnostics:
+        report.append(f"stdin:{diagnostic['line']}:{diagnostic['column']}: "
+                      f"{diagnostic['code']} {diagnostic['text']}")
+
+        if diagnostic["line"] > len(lines):
+            line = ""
+        else:
+            line = lines[diagnostic["line"] - 1]
+
+        report.append(line.rstrip())
+        report.append(
+            re.sub(r"\S", " ", line[:diagnostic["column"] - 1]) + "^"
+        )
+
+    return "".join(f"{line}\n" for line in report)
+
+
+def run_style_check(content):
+    """
+    Run check_style in the process pool. If the pool is disabled with
+    STYLE_CHECK_WORKERS = 0, or it has broken down, the check is run in
+    the calling thread instead.
+    :param content: (str) Python source code
+    :return: (list) diagnostics, or None if the check timed out
+    """
+    pool = get_pool()
+
+    if pool is None:
+        return check_style(content)
+
+    future = pool.submit(check_style, content)
+
+    try:
+        return future.result(timeout=settings.STYLE_CHECK_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        style_logger.warning("Style check timed out")
+        return None
+    except BrokenProcessPool:
+        reset_pool()
+        return check_style(content)
+
+
+def get_pool():
+    """
+    Return the shared process pool, created on the first call. Worker
+    processes are spawned rather than forked by default because the web
+    server process is multithreaded.
+    :return: (ProcessPoolExecutor) or None if the pool is disabled
+    """
+    global _pool
+
+    if settings.STYLE_CHECK_WORKERS < 1:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.STYLE_CHECK_WORKERS,
+                mp_context=multiprocessing.get_context(
+                    settings.STYLE_CHECK_START_METHOD
+                )
+            )
+
+    return _pool
+
+
+def reset_pool():
+    """
+    Discard a broken process pool. A new one is created on the next check.
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
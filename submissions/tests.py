@@ -1,3 +1,173 @@
-from django.test import TestCase
+import json
+import random
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .models import Exercise
+from .utils import iter_json_array, sort_submissions
+
+
+def reference_sort_submissions(submissions, exercise, deadline_passed):
+    """
+    Copy of the original sort_submissions, which scanned the students
+    once per repeated sighting. The original deleted with del and raised
+    KeyError when a submission was already removed, here the removal
+    is skipped instead.
+    """
+    accepted = {}
+    students = {}
+    duplicates = []
+
+    for sub in submissions:
+        if sub["Grade"] < exercise.min_points:
+            continue
+
+        if exercise.max_points is not None and \
+                sub["Grade"] > exercise.max_points:
+            continue
+
+        if not deadline_passed and "ready_for_review" not in sub:
+            continue
+
+        student_info = {
+            "email": sub["Email"],
+            "student_id": sub["StudentID"],
+            "user_id": sub["UserID"]
+        }
+
+        if sub["SubmissionID"] not in accepted:
+            accepted[sub["SubmissionID"]] = {
+                "grade": sub["Grade"],
+                "penalty": sub["Penalty"],
+                "grader_lang_en": False,
+                "students": [student_info]
+            }
+
+            if "feedback_lang" in sub:
+                if sub["feedback_lang"] == "en":
+                    accepted[sub["SubmissionID"]]["grader_lang_en"] = True
+
+            elif "__grader_lang" in sub and sub["__grader_lang"] == "en":
+                accepted[sub["SubmissionID"]]["grader_lang_en"] = True
+
+        else:
+            accepted[sub["SubmissionID"]]["students"].append(student_info)
+
+        if sub["UserID"] not in students:
+            students[sub["UserID"]] = [sub["SubmissionID"]]
+        else:
+            students[sub["UserID"]].append(sub["SubmissionID"])
+            duplicates.append(sub["UserID"])
+
+    for student in duplicates:
+        for sub in students[student]:
+            if sub in accepted and len(accepted[sub]["students"]) == 1:
+                del accepted[sub]
+
+    return accepted
+
+
+def make_submission(rnd, sub_count, user_count):
+    sub_id = rnd.randint(1, sub_count)
+    user_id = rnd.randint(1, user_count)
+    sub = {
+        "SubmissionID": sub_id,
+        "UserID": user_id,
+        "Email": f"{user_id}@example.com",
+        "StudentID": str(user_id),
+        "Grade": rnd.randint(0, 6),
+        "Penalty": rnd.choice([None, 0.5]),
+    }
+
+    if rnd.random() < 0.7:
+        sub["ready_for_review"] = 1
+    if rnd.random() < 0.3:
+        sub["feedback_lang"] = rnd.choice(["en", "fi"])
+    elif rnd.random() < 0.3:
+        sub["__grader_lang"] = rnd.choice(["en", "fi"])
+
+    return sub
+
+
+class SortSubmissionsTest(SimpleTestCase):
+
+    def submission(self, sub_id, user_id, grade=5):
+        return {
+            "SubmissionID": sub_id,
+            "UserID": user_id,
+            "Email": f"{user_id}@example.com",
+            "StudentID": str(user_id),
+            "Grade": grade,
+            "Penalty": None,
+        }
+
+    def test_matches_reference(self):
+        # Every case has its own seed, so a failing case can be reproduced
+        for case in range(5000):
+            rnd = random.Random(case)
+            sub_count = rnd.randint(1, 10)
+            user_count = rnd.randint(1, 10)
+            submissions = [
+                make_submission(rnd, sub_count, user_count)
+                for _ in range(rnd.randint(0, 25))
+            ]
+            exercise = Exercise(min_points=rnd.randint(0, 2),
+                                max_points=rnd.choice([None, 5]))
+            deadline_passed = rnd.random() < 0.5
+
+            with self.subTest(case=case):
+                self.assertEqual(
+                    sort_submissions(iter(submissions), exercise,
+                                     deadline_passed),
+                    reference_sort_submissions(submissions, exercise,
+                                               deadline_passed)
+                )
+
+    def test_student_seen_three_times(self):
+        # Raised KeyError before: the student was a duplicate twice
+        submissions = [
+            self.submission(1, 10),
+            self.submission(2, 10),
+            self.submission(3, 10),
+            self.submission(3, 11),
+        ]
+        accepted = sort_submissions(submissions, Exercise(min_points=1), True)
+
+        self.assertEqual(list(accepted), [3])
+        self.assertEqual(
+            [student["user_id"] for student in accepted[3]["students"]],
+            [10, 11]
+        )
+
+    def test_group_submission_is_kept(self):
+        submissions = [
+            self.submission(1, 10),
+            self.submission(1, 11),
+            self.submission(2, 11),
+            self.submission(3, 12),
+        ]
+        accepted = sort_submissions(submissions, Exercise(min_points=1), True)
+
+        self.assertEqual(sorted(accepted), [1, 3])
+
+
+class IterJsonArrayTest(SimpleTestCase):
+
+    def decode(self, text):
+        # Split the document at every position to test chunk boundaries
+        for split in range(len(text) + 1):
+            yield list(iter_json_array([text[:split], text[split:]]))
+
+    def test_valid_arrays(self):
+        for text in ['[]', ' [ ] ', '[1]', '[1, 2 ,3]', '[[], {}]',
+                     '[{"a": "1,]"}, 25]']:
+            for items in self.decode(text):
+                self.assertEqual(items, json.loads(text))
+
+    def test_malformed_arrays(self):
+        for text in ['[1 2]', '[,1]', '[1,,2]', '[1,]', '[,]',
+                     '[{"a": 1}{"b": 2}]', '{"a": 1}', '[1, 2', '[1]x']:
+            for split in range(len(text) + 1):
+                with self.subTest(text=text, split=split):
+                    with self.assertRaises(ValueError):
+                        list(iter_json_array([text[:split], text[split:]]))
@@ -73,6 +73,14 @@ urlpatterns = [
          views.ReleaseFeedbacksRedirectView.as_view(),
          name='release'),
 
+    path('exercises/<int:pk>-<int:exercise_id>/submissions/release/status/',
+         views.ReleaseStatusView.as_view(),
+         name='release_status'),
+
+    path('exercises/<int:pk>-<int:exercise_id>/submissions/release/resolve/',
+         views.ResolveReleaseRedirectView.as_view(),
+         name='release_resolve'),
+
     path('exercises/<int:pk>-<int:exercise_id>/submissions/batch_assess/',
          views.BatchAssessRedirectView.as_view(),
          name='batch_assess'),
@@ -92,4 +100,8 @@ urlpatterns = [
     path('exercises/<int:pk>-<int:exercise_id>/submissions/csv/',
          views.DownloadCsvView.as_view(),
          name='csv'),
+
+    path('jobs/<int:pk>/',
+         views.JobStatusView.as_view(),
+         name='job_status'),
 ]
@@ -3,36 +3,42 @@ Module for various utility functions
 """
 
 
-import io
+import codecs
+import hashlib
+import heapq
+import itertools
 import json
 import logging
-import pycodestyle
 import random
+import re
 import requests
-import sys
+import threading
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.db.models import Count, Q
 from django.utils import timezone
 from pygments import highlight
 from pygments.lexers import get_lexer_for_filename
 from pygments.util import ClassNotFound
 from pygments.formatters.html import HtmlFormatter
 
-from .models import BaseCourse, Course, Exercise, Feedback, Student
+from . import stylecheck
+from .aplus import get_client
+from .models import (BaseCourse, Course, Exercise, Feedback, Job, Student,
+                     User)
 
 util_logger = logging.getLogger(__name__)
-debug_feedbacks = []
 
+_module_states_locks = {}
 
-def get_json(url, token, params=None):
-    resp = requests.get(
-        url, headers={"Authorization": f"Token {token}"}, params=params
-    )
 
-    if resp.status_code == requests.codes.ok:
-        return resp.json()
-    else:
-        resp.raise_for_status()
+def get_json(url, token, params=None, ttl=None):
+    return get_client(token).get_json(url, params, ttl)
 
 
 def add_user_to_course(user, login_info):
@@ -61,10 +67,17 @@ def add_user_to_course(user, login_info):
 
     if login_info["roles"] == "Instructor":
         course.base_course.teachers.add(user)
-        get_exercises(course)
+
+        # Exercises are synchronized in the background so that the login
+        # doesn't have to wait. Skipped if the course was synchronized
+        # within COURSE_SYNC_INTERVAL.
+        if not cache.get(f"course_synced_{course.pk}"):
+            Job.objects.enqueue("get_exercises", user=user,
+                                course_id=course.pk)
     if login_info["roles"] == "TA,TeachingAssistant":
         course.base_course.assistants.add(user)
 
+    user.clear_course_roles()
     return True
 
 
@@ -99,23 +112,103 @@ def create_course(api_url, api_id, label, name, token, lms_instance_id):
     return course
 
 
-def update_course_details(course):
+def get_feedback_counts(exercise, user):
     """
+    Count the feedbacks of the exercise in total and for the given grader
+    with one query. The counts are cached for a short while and the cache
+    is invalidated when a feedback of the exercise is saved or deleted.
+    :param exercise: (Exercise) model object
+    :param user: (User) grader
+    :return: (dict) counts to be added to the template context
+    """
+    version = cache.get(f"feedback_counts_version_{exercise.pk}", 0)
+    key = f"feedback_counts_{exercise.pk}_{version}_{user.pk}"
+    counts = cache.get(key)
+
+    if counts is None:
+        mine = Q(grader=user.pk)
+        ready = Q(status=Feedback.READY)
+        counts = exercise.feedback_set.order_by().aggregate(
+            feedback_count=Count("id"),
+            ready_count=Count("id", filter=ready),
+            grader_lang_en=Count("id", filter=Q(grader_lang_en=True)),
+            my_feedback_count=Count("id", filter=mine),
+            my_ready_count=Count("id", filter=mine & ready),
+        )
+        cache.set(key, counts, settings.FEEDBACK_COUNTS_CACHE_TIMEOUT)
 
-    :param course:
-    :return:
+    return counts
+
+
+def invalidate_feedback_counts(exercise_id):
+    """
+    Invalidate the cached feedback counts of the exercise.
+    :param exercise_id: (int) primary key of the exercise
+    """
+    key = f"feedback_counts_version_{exercise_id}"
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_staff_choices(base_course_id):
+    """
+    Return the teachers and assistants of the course as choices for
+    a grader field. The list is cached and invalidated when the staff
+    of the course changes.
+    :param base_course_id: (int) primary key of the BaseCourse
+    :return: (list) (user id, label) tuples
+    """
+    key = f"staff_choices_{base_course_id}"
+    choices = cache.get(key)
+
+    if choices is None:
+        staff = User.objects.filter(
+            Q(
+                courses_assistant=base_course_id
+            ) | Q(
+                courses_teacher=base_course_id
+            )
+        ).distinct()
+        choices = [(user.pk, str(user)) for user in staff]
+        cache.set(key, choices)
+
+    return choices
+
+
+def invalidate_staff_choices(base_course_id):
+    """
+    Invalidate the cached staff choices of the course.
+    :param base_course_id: (int) primary key of the BaseCourse
+    """
+    cache.delete(f"staff_choices_{base_course_id}")
+
+
+def update_course_details(course):
+    """
+    Update the ending time of the course and archive courses which have
+    ended long ago. Course is saved only if something has changed.
+    :param course: (Course) model object
+    :return: (bool) True if the course was changed
     """
     util_logger.debug(f"{datetime.now()} updating course: "
                       f"{course}")
 
     course_details = get_json(course.api_url, course.api_token)
-    course.ending_time = datetime.fromisoformat(course_details["ending_time"])
+    ending_time = datetime.fromisoformat(course_details["ending_time"])
     storage_time = timedelta(days=2*365)
+    archived = course.archived or \
+        ending_time < timezone.now() - storage_time
 
-    if course.ending_time < timezone.now() - storage_time:
-        course.archived = True
+    if course.ending_time != ending_time or course.archived != archived:
+        course.ending_time = ending_time
+        course.archived = archived
+        course.save(update_fields=["ending_time", "archived"])
+        return True
 
-    course.save()
+    return False
 
 
 def get_exercises(course):
@@ -123,101 +216,341 @@ def get_exercises(course):
     Get the exercises of the specified course from Plussa. Remove or mark
     as "not found" if there are exercises in database which are not found
     in Plussa anymore. Update exercise details.
+
+    Existing exercises are loaded with one query and compared to the ones
+    in Plussa. Only new and changed exercises are written to the database.
     param course: (Course) model object
+    :return: (bool) True if any exercise was added, changed or removed
     """
     util_logger.debug(f"{datetime.now()} getting exercises: "
                       f"{course}")
 
     modules = get_json(course.exercise_url, course.api_token)["results"]
-    current_exercises = []
+    set_module_states(course, modules)
+    plussa_exercises = {}
 
     for module in modules:
         for exercise in module["exercises"]:
-            try:
-                exercise_obj = Exercise.objects.get(api_url=exercise["url"])
-
-            except Exercise.DoesNotExist:
-                exercise_obj = Exercise(
-                    course=course,
-                    exercise_id=exercise["id"],
-                    module=module["url"],
-                    api_url=exercise["url"],
-                )
-
-            # Clarify the name
-            exercise_obj.name = exercise["display_name"].strip("|").replace(
-                "|fi:", "").replace("sv:", "").replace("en:", "")
+            plussa_exercises[exercise["url"]] = (module["url"], exercise)
 
-            # Hack for numerical ordering
-            chapter_num = exercise_obj.name.split()[0].split(".")
-            for i in range(0, len(chapter_num)):
-                if chapter_num[i].isdigit():
-                    chapter_num[i] = int(chapter_num[i])
-                else:
-                    chapter_num[i] = 0
+    existing = {
+        exercise.api_url: exercise for exercise in Exercise.objects.filter(
+            Q(course=course) | Q(api_url__in=list(plussa_exercises))
+        )
+    }
 
-            exercise_obj.chapter_num = chapter_num
+    # Stop polling submissions if course ending time is passed
+    safety_period = timedelta(days=30)
+    course_ended = course.ending_time < timezone.now() - safety_period
+
+    new_exercises = []
+    changed_exercises = []
+    changed_fields = set()
+    current_exercises = set()
+
+    for api_url, (module_url, exercise) in plussa_exercises.items():
+        # Clarify the name
+        name = exercise["display_name"].strip("|").replace(
+            "|fi:", "").replace("sv:", "").replace("en:", "")
+
+        # Hack for numerical ordering
+        chapter_num = name.split()[0].split(".")
+        for i in range(0, len(chapter_num)):
+            if chapter_num[i].isdigit():
+                chapter_num[i] = int(chapter_num[i])
+            else:
+                chapter_num[i] = 0
+
+        current_exercises.add(exercise["id"])
+        exercise_obj = existing.get(api_url)
+
+        if exercise_obj is None:
+            new_exercises.append(Exercise(
+                course=course,
+                exercise_id=exercise["id"],
+                module=module_url,
+                api_url=api_url,
+                name=name,
+                chapter_num=chapter_num,
+            ))
+            continue
 
-            # Stop polling submissions if course ending time is passed
-            if exercise_obj.in_grading:
-                safety_period = timedelta(days=30)
-                if course.ending_time < timezone.now() - safety_period:
-                    exercise_obj.stop_polling = True
+        values = {
+            "name": name,
+            "chapter_num": chapter_num,
+            "stop_polling": exercise_obj.stop_polling or (
+                exercise_obj.in_grading and course_ended
+            ),
+        }
 
-            exercise_obj.save()
-            current_exercises.append(exercise_obj.exercise_id)
+        if set_changed_fields(exercise_obj, values, changed_fields):
+            changed_exercises.append(exercise_obj)
 
     # Check that exercises in database are still found in Plussa
-    for exercise in course.exercise_set.all().order_by("chapter_num"):
-        if exercise.exercise_id not in current_exercises:
-            if exercise.in_grading:
-                exercise.error_state = "Exercise not found"
-                exercise.stop_polling = True
-                exercise.save()
-            else:
-                exercise.delete()
+    removed_exercises = []
 
+    for exercise in existing.values():
+        if exercise.course_id != course.pk or \
+                exercise.exercise_id in current_exercises:
+            continue
 
-def update_submissions(exercise):
+        if exercise.in_grading:
+            values = {
+                "error_state": "Exercise not found",
+                "stop_polling": True,
+            }
+
+            if set_changed_fields(exercise, values, changed_fields):
+                changed_exercises.append(exercise)
+        else:
+            removed_exercises.append(exercise.pk)
+
+    with transaction.atomic():
+        if new_exercises:
+            Exercise.objects.bulk_create(new_exercises)
+        if changed_exercises:
+            Exercise.objects.bulk_update(changed_exercises,
+                                         sorted(changed_fields))
+        if removed_exercises:
+            Exercise.objects.filter(pk__in=removed_exercises).delete()
+
+    cache.set(f"course_synced_{course.pk}", True,
+              settings.COURSE_SYNC_INTERVAL)
+
+    return bool(new_exercises or changed_exercises or removed_exercises)
+
+
+def set_changed_fields(obj, values, changed_fields):
+    """
+    Set the values which differ from the current ones to the object.
+    :param obj: (Model) model object
+    :param values: (dict) field name: new value
+    :param changed_fields: (set) names of the changed fields are added here
+    :return: (bool) True if any value was changed
+    """
+    changed = False
+
+    for field, value in values.items():
+        if getattr(obj, field) != value:
+            setattr(obj, field, value)
+            changed_fields.add(field)
+            changed = True
+
+    return changed
+
+
+def fetch_submissions(exercise, deadline_passed):
+    """
+    Request Plussa api to retrieve recent list of submissions. The response
+    is read as a stream and the submissions are sorted one at a time, so
+    only the accepted submissions are kept in memory, not the whole export.
+    Database is not touched, so this is safe to call from a worker thread
+    as long as exercise.course has already been loaded.
+
+    The sync cursor is a hash of everything the accepted submissions
+    depend on: the raw submission data, the deadline status and the point
+    limits.
+    :param exercise: (Exercise) model object
+    :param deadline_passed: (bool) True, if the deadline has passed
+    :return: (tuple) accepted submissions, sync cursor
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        [deadline_passed, exercise.min_points, exercise.max_points]
+    ).encode())
+
+    resp = get_client(exercise.course.api_token).get(
+        exercise.course.data_url,
+        {"exercise_id": exercise.exercise_id, "format": "json"},
+        stream=True
+    )
+
+    with resp:
+        if resp.status_code != requests.codes.ok:
+            resp.raise_for_status()
+
+        def chunks():
+            decoder = codecs.getincrementaldecoder("utf-8")()
+
+            for chunk in resp.iter_content(
+                    chunk_size=settings.SUBMISSION_DATA_CHUNK_SIZE):
+                digest.update(chunk)
+                yield decoder.decode(chunk)
+
+            yield decoder.decode(b"", final=True)
+
+        accepted = sort_submissions(iter_json_array(chunks()), exercise,
+                                    deadline_passed)
+
+    return accepted, digest.hexdigest()
+
+
+def iter_json_array(chunks):
+    """
+    Decode the items of a json array one at a time from the text chunks of
+    the document, without reading the whole document into memory.
+    :param chunks: (iterable) str chunks of a json array
+    :return: (generator) decoded items
+    """
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r"[ \t\n\r]*")
+    buffer = ""
+    opened = False
+    closed = False
+    # Expected next inside the array: the first item or "]", an item
+    # after a comma, or a comma or "]" after an item
+    expected = "first"
+
+    for chunk in itertools.chain(chunks, [None]):
+        final = chunk is None
+        if not final:
+            buffer += chunk
+        pos = 0
+
+        while True:
+            pos = whitespace.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+
+            if closed:
+                raise ValueError("Extra data after the json array")
+
+            if not opened:
+                if buffer[pos] != "[":
+                    raise ValueError("Submission data is not a json array")
+                opened = True
+                pos += 1
+                continue
+
+            if buffer[pos] == "]":
+                if expected == "item":
+                    raise ValueError("Trailing comma in the json array")
+                closed = True
+                pos += 1
+                continue
+
+            if buffer[pos] == ",":
+                if expected != "separator":
+                    raise ValueError("Missing item in the json array")
+                expected = "item"
+                pos += 1
+                continue
+
+            if expected == "separator":
+                raise ValueError("Missing comma in the json array")
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The item continues in the next chunk
+                if final:
+                    raise
+                break
+
+            # A number at the end of the chunk may continue in the next one
+            if end == len(buffer) and not final:
+                break
+
+            yield item
+            expected = "separator"
+            pos = end
+
+        buffer = buffer[pos:]
+
+    if not closed:
+        raise ValueError("Submission data ended before the json array")
+
+
+def update_submissions(exercise, fetched=None):
     """
     Request Plussa api to retrieve recent list of submissions. Create Feedback
     objects for new submissions and delete the old ones.
-    :param exercise:
-    :return:
+    :param exercise: (Exercise) model object
+    :param fetched: (tuple) result of fetch_submissions, if already fetched
+    :return: (bool) True if any submissions were changed
     """
     util_logger.debug(f"{datetime.now()} updating submissions: "
                       f"{exercise}")
 
-    # TODO: Following code block should be in its own function
     try:
-        submissiondata = get_json(
-            exercise.course.data_url, exercise.course.api_token,
-            {"exercise_id": exercise.exercise_id, "format": "json"}
-        )
-        exercise.error_state = None
-        exercise.save()
-    except requests.HTTPError as e:
+        if fetched is None:
+            fetched = fetch_submissions(exercise, check_deadline(exercise))
+        if exercise.error_state is not None:
+            exercise.error_state = None
+            exercise.save(update_fields=["error_state"])
+    except requests.RequestException as e:
+        # Settings may have been changed by a teacher meanwhile
         exercise.error_state = e
-        exercise.save()
+        exercise.save(update_fields=["error_state"])
         raise e
 
-    # TODO: Move deadline check to the sort_submissions function
-    deadline_passed = check_deadline(exercise)
-    accepted = sort_submissions(submissiondata, exercise, deadline_passed)
-    old_feedbacks = []
+    accepted, cursor = fetched
+    changed = False
+
+    if cursor != exercise.sync_cursor:
+        with transaction.atomic():
+            changed = ingest_submissions(exercise, accepted)
+            exercise.sync_cursor = cursor
+            exercise.save(update_fields=["sync_cursor"])
+
+    elif not exercise.feedback_set.filter(grader=None).exists():
+        # Nothing has changed and there is nothing to divide
+        return changed
+
+    if exercise.work_div == Exercise.EVEN_DIV:
+        divide_submissions(exercise)
+
+    return changed
+
+
+def ingest_submissions(exercise, accepted):
+    """
+    Create Feedback objects for new submissions, update the details of the
+    existing ones and delete the ones replaced by a newer submission.
+    Students and feedbacks of the exercise are loaded once and the changes
+    are written in bulk, so the number of queries doesn't depend on the
+    number of submissions.
+    :param exercise: (Exercise) model object
+    :param accepted: (dict) accepted submissions from sort_submissions
+    :return: (bool) True if anything was written to the database
+    """
+    students = get_students(
+        accepted, exercise.course.base_course.lms_instance_id
+    )
+    feedbacks = {fb.sub_id: fb for fb in exercise.feedback_set.all()}
+    feedback_ids = {fb.id: fb.sub_id for fb in feedbacks.values()}
+
+    # Current students of each feedback and the other way round
+    Membership = Feedback.students.through
+    memberships = {}
+    members = {sub_id: set() for sub_id in feedbacks}
+    student_subs = defaultdict(set)
+
+    for pk, feedback_id, student_id in Membership.objects.filter(
+            feedback__exercise=exercise).values_list(
+                "id", "feedback_id", "student_id"):
+        sub_id = feedback_ids[feedback_id]
+        memberships[(sub_id, student_id)] = pk
+        members[sub_id].add(student_id)
+        student_subs[student_id].add(sub_id)
+
+    penalty_field = Feedback._meta.get_field("penalty")
+    feedback_bases = {}
+    created = {}
+    changed = set()
+    old_feedbacks = set()
 
     for sub in accepted:
         for student_info in accepted[sub]["students"]:
-            student, st_created = Student.objects.get_or_create(
-                    aplus_user_id=student_info["user_id"],
-                    lms_instance_id=exercise.course.base_course.lms_instance_id,
-                    defaults={
-                        "student_id": student_info["student_id"],
-                        "email": student_info["email"],
-                    }
-            )
+            student = students[str(student_info["user_id"])]
+
             # student may have previous submission, only one per exercise
-            old_fb = student.my_feedbacks.filter(exercise=exercise).first()
+            old_fb = None
+            if student_subs[student.id]:
+                old_fb = min(
+                    (feedbacks[sub_id] for sub_id in student_subs[student.id]),
+                    key=lambda fb: (fb.status, fb.released, fb.sub_id)
+                )
             feedback = None
 
             if old_fb:
@@ -225,73 +558,238 @@ def update_submissions(exercise):
                     # Assessment have been started, keep the old feedback
                     continue
                 elif old_fb.sub_id != sub and old_fb.status == Feedback.BASE:
-                    old_fb.students.remove(student)
-                    if old_fb.sub_id not in old_feedbacks:
-                        old_feedbacks.append(old_fb.sub_id)
+                    members[old_fb.sub_id].discard(student.id)
+                    student_subs[student.id].discard(old_fb.sub_id)
+                    old_feedbacks.add(old_fb.sub_id)
                 elif old_fb.sub_id == sub:
                     feedback = old_fb
 
             if not feedback:
-                feedback, fb_created = Feedback.objects.get_or_create(
+                feedback = feedbacks.get(sub)
+
+            if not feedback:
+                feedback = Feedback(
                     exercise=exercise,
                     sub_id=sub,
-                    defaults={
-                        "grader_lang_en": accepted[sub]["grader_lang_en"],
-                    }
+                    grader_lang_en=accepted[sub]["grader_lang_en"]
                 )
-                # TODO: This check should be in the function add_feedback_base
-                if fb_created:
-                    if exercise.feedback_base_fi or exercise.feedback_base_en:
-                        add_feedback_base(exercise, feedback)
-                    if old_fb and feedback.grader_lang_en == old_fb.grader_lang_en:
-                        feedback.grader = old_fb.grader
+                if exercise.feedback_base_fi or exercise.feedback_base_en:
+                    lang_en = feedback.grader_lang_en
+                    if lang_en not in feedback_bases:
+                        feedback_bases[lang_en] = get_feedback_base(
+                            exercise, lang_en
+                        )
+                    feedback.feedback = feedback_bases[lang_en]
+                if old_fb and feedback.grader_lang_en == old_fb.grader_lang_en:
+                    feedback.grader_id = old_fb.grader_id
+
+                feedbacks[sub] = feedback
+                members[sub] = set()
+                created[sub] = feedback
 
             # Add or update other details
-            if accepted[sub]["penalty"]:
-                feedback.penalty = accepted[sub]["penalty"]
-            else:
-                feedback.penalty = 0.0
+            penalty = penalty_field.to_python(accepted[sub]["penalty"] or 0.0)
+
+            if feedback.penalty != penalty or \
+                    feedback.auto_grade != accepted[sub]["grade"]:
+                feedback.penalty = penalty
+                feedback.auto_grade = accepted[sub]["grade"]
+                if sub not in created:
+                    changed.add(sub)
+
+            members[sub].add(student.id)
+            student_subs[student.id].add(sub)
+
+    # Feedbacks left without students have been replaced by newer ones
+    removed = {sub_id for sub_id in old_feedbacks if not members[sub_id]}
+
+    for sub_id in removed & created.keys():
+        del created[sub_id]
+
+    if created:
+        Feedback.objects.bulk_create(created.values(), ignore_conflicts=True)
+        for sub_id, pk in Feedback.objects.filter(
+                exercise=exercise, sub_id__in=created).values_list(
+                    "sub_id", "id"):
+            created[sub_id].id = pk
+
+    changed -= removed
+    if changed:
+        Feedback.objects.bulk_update(
+            [feedbacks[sub_id] for sub_id in changed],
+            ["penalty", "auto_grade"]
+        )
 
-            feedback.auto_grade = accepted[sub]["grade"]
-            feedback.save()
+    removed_memberships = [
+        pk for (sub_id, student_id), pk in memberships.items()
+        if sub_id not in removed and student_id not in members[sub_id]
+    ]
+    if removed_memberships:
+        Membership.objects.filter(pk__in=removed_memberships).delete()
 
-            feedback.students.add(student)
+    new_memberships = [
+        Membership(feedback_id=feedbacks[sub_id].id, student_id=student_id)
+        for sub_id in members if sub_id not in removed
+        for student_id in members[sub_id]
+        if (sub_id, student_id) not in memberships
+    ]
+    if new_memberships:
+        Membership.objects.bulk_create(new_memberships, ignore_conflicts=True)
 
-    for sub_id in old_feedbacks:
-        try:
-            fb = Feedback.objects.get(sub_id=sub_id)
-            if not fb.students.exists():
-                fb.delete()
-        except Feedback.DoesNotExist:
-            continue
+    removed_feedbacks = [
+        feedbacks[sub_id].id for sub_id in removed if feedbacks[sub_id].id
+    ]
+    if removed_feedbacks:
+        Feedback.objects.filter(pk__in=removed_feedbacks).delete()
 
-    if exercise.work_div == Exercise.EVEN_DIV:
-        divide_submissions(exercise)
+    if created or changed:
+        invalidate_feedback_counts(exercise.pk)
+
+    return bool(created or changed or removed_memberships or
+                new_memberships or removed_feedbacks)
+
+
+def get_students(accepted, lms_instance_id):
+    """
+    Return the students of accepted submissions. Students who are not yet
+    in the database are created.
+    :param accepted: (dict) accepted submissions from sort_submissions
+    :param lms_instance_id: (str) lms instance of the course
+    :return: (dict) Student objects by A+ user id
+    """
+    infos = {}
 
+    for sub in accepted.values():
+        for student_info in sub["students"]:
+            infos.setdefault(str(student_info["user_id"]), student_info)
 
-def check_deadline(exercise):
-    # Get info related to exercise module and check if module is open or not
-    if get_json(exercise.module, exercise.course.api_token)["is_open"]:
+    students = Student.objects.filter(lms_instance_id=lms_instance_id)
+    found = {
+        student.aplus_user_id: student
+        for student in students.filter(aplus_user_id__in=infos)
+    }
+    missing = [user_id for user_id in infos if user_id not in found]
+
+    if missing:
+        Student.objects.bulk_create(
+            [
+                Student(
+                    aplus_user_id=user_id,
+                    lms_instance_id=lms_instance_id,
+                    student_id=infos[user_id]["student_id"],
+                    email=infos[user_id]["email"]
+                )
+                for user_id in missing
+            ],
+            ignore_conflicts=True
+        )
+        for student in students.filter(aplus_user_id__in=missing):
+            found[student.aplus_user_id] = student
+
+    return found
+
+
+def check_deadline(exercise, module=None):
+    """
+    Check if the module of the exercise is closed.
+    :param exercise: (Exercise) model object with course loaded
+    :param module: (dict) result of get_module_state, if already known
+    :return: (bool) True if the deadline has passed
+    """
+    if module is None:
+        module = get_module_state(exercise)
+
+    if module["is_open"]:
         # util_logger.debug(f"{exercise} module is still open, consent needed to retrieve submissions")
         return False
         
     return True
 
 
+def get_module_state(exercise):
+    """
+    Return the open state and closing time of the module of the exercise.
+    Module states of the course are shared by all its exercises, see
+    get_module_states. A module missing from the exercise tree, or listed
+    there without its state, is read from the module api instead.
+    :param exercise: (Exercise) model object with course loaded
+    :return: (dict) {"is_open": bool, "closing_time": str}
+    """
+    module = get_module_states(exercise.course).get(exercise.module)
+
+    if module is None:
+        module = get_json(exercise.module, exercise.course.api_token)
+        module = {
+            "is_open": module["is_open"],
+            "closing_time": module.get("closing_time"),
+        }
+
+    return module
+
+
+def get_module_states(course):
+    """
+    Return the open state and closing time of every module of the course
+    from the course exercise tree. The states are cached for
+    MODULE_STATES_TIMEOUT seconds, so the tree is fetched once per polling
+    pass instead of every module once per exercise.
+    :param course: (Course) model object
+    :return: (dict) module url: {"is_open": bool, "closing_time": str}
+    """
+    module_states = cache.get(f"module_states_{course.pk}")
+
+    if module_states is not None:
+        return module_states
+
+    # Exercises of the course polled concurrently wait for one lookup
+    with _module_states_locks.setdefault(course.pk, threading.Lock()):
+        module_states = cache.get(f"module_states_{course.pk}")
+
+        if module_states is None:
+            modules = get_json(course.exercise_url,
+                               course.api_token)["results"]
+            module_states = set_module_states(course, modules)
+
+    return module_states
+
+
+def set_module_states(course, modules):
+    """
+    Cache the module states of the course from the exercise tree. Modules
+    listed without the open state or the closing time are left out, so
+    get_module_state reads them from the module api.
+    :param course: (Course) model object
+    :param modules: (list) modules of the course exercise tree
+    :return: (dict) module states, see get_module_states
+    """
+    module_states = {
+        module["url"]: {
+            "is_open": module.get("is_open"),
+            "closing_time": module.get("closing_time"),
+        }
+        for module in modules
+        if module.get("is_open") is not None and module.get("closing_time")
+    }
+    cache.set(f"module_states_{course.pk}", module_states,
+              settings.MODULE_STATES_TIMEOUT)
+
+    return module_states
+
+
 def sort_submissions(submissions, exercise, deadline_passed):
     """
     Käydään läpi jsonin palautukset ja lisätään hyväksytyt accepted-dictiin. 
     Pääsääntöisesti täysin turhaa ajan tuhlausta, mutta tarvitaan jos 
     ryhmäpalautuksen ryhmä on jälkikäteen tehty henkilökunnan toimesta.
-    :param submissions: (dict) tehtävän viimeisimmät/parhaat palautukset 
+    :param submissions: (iterable) tehtävän viimeisimmät/parhaat palautukset
     :param exercise: (Exercise model object) tarkastettavan tehtävän tiedot
     :param deadline_passed: (boolean) True, jos tehtävän deadline on mennyt
     :return: (dict) hyväksytyt palautukset, jotka otetaan arvosteluun
     """
 
-    accepted = {}    # Hyväksyttyjen palautusten oleellinen informaatio
-    students = {}    # Opiskelijat ja heidän tekemänsä palautukset
-    duplicates = []  # Lista opiskelijoista, joilla enemmän kuin yksi palautus
+    accepted = {}       # Hyväksyttyjen palautusten oleellinen informaatio
+    students = {}       # Opiskelijat ja heidän tekemiensä palautusten joukko
+    duplicates = set()  # Opiskelijat, joilla enemmän kuin yksi palautus
 
     for sub in submissions:
 
@@ -339,199 +837,337 @@ def sort_submissions(submissions, exercise, deadline_passed):
                 }
             )
 
-        if sub["UserID"] not in students:
-            students[sub["UserID"]] = [sub["SubmissionID"]]
-        else:
-            # Parityösähläyksissä opiskelijalle on voinut tallentua
-            # useampi kuin yksi palautus. Laitetaan tuplat talteen
-            # ja poistetaan tarpeettomat palautukset seuraavassa vaiheessa.
-            students[sub["UserID"]].append(sub["SubmissionID"])
-            duplicates.append(sub["UserID"])
+        student_subs = students.setdefault(sub["UserID"], set())
+        student_subs.add(sub["SubmissionID"])
 
-    # print(duplicates)
-    # print(students)
-    # print(accepted)
+        # Parityösähläyksissä opiskelijalle on voinut tallentua
+        # useampi kuin yksi palautus. Laitetaan tuplat talteen
+        # ja poistetaan tarpeettomat palautukset seuraavassa vaiheessa.
+        if len(student_subs) > 1:
+            duplicates.add(sub["UserID"])
 
+    # Jokainen tuplaopiskelija ja hänen palautuksensa käydään läpi kerran.
     for student in duplicates:
         for sub in students[student]:
             # Poistetaan opiskelijalta se palautus, joka EI ole paripalautus.
-            # Tällöin opiskelijatietoja siis 1 kpl
-            if len(accepted[sub]["students"]) == 1:
-                # print("Poistetaan tupla:", sub, accepted[sub])
+            # Tällöin opiskelijatietoja siis 1 kpl. Sama palautus on voinut
+            # jo poistua toisen opiskelijan kohdalla.
+            if sub in accepted and len(accepted[sub]["students"]) == 1:
                 del accepted[sub]
 
     return accepted
 
 
-def add_feedback_base(exercise, feedback):
+def apply_grading_settings(exercise):
     """
-    Lisätään/päivitetään palautepohja mikäli palautetta ei ole vielä muokattu.
+    Apply changed grading settings of the exercise to its feedbacks which
+    are still templates: remove the ones that are no longer accepted and
+    update the feedback bases.
+    :param exercise: (Exercise) model object
+    """
+    # Minimum points of accepted submission have been increased.
+    # Remove submissions with points lesser than new limit but
+    # only if the feedback status is still template.
+    deleted, _ = exercise.feedback_set.filter(
+        status=Feedback.BASE,
+        auto_grade__lt=exercise.min_points
+    ).delete()
+
+    # Maximum points for auto grade have been decreased.
+    # Remove submissions with points greater than new limit but
+    # only if the feedback status is still template.
+    if exercise.max_points is not None:
+        deleted += exercise.feedback_set.filter(
+            status=Feedback.BASE,
+            auto_grade__gt=exercise.max_points
+        ).delete()[0]
+
+    # The sync cursor doesn't cover the deleted feedbacks. If the limits
+    # are changed back, the next poll must add them again.
+    if deleted:
+        exercise.sync_cursor = None
+        exercise.save(update_fields=["sync_cursor"])
+
+    # Update feedback base if it exists. Update is done only
+    # if Feedback object's status is Feedback.BASE
+    apply_feedback_base(exercise)
+
+
+def apply_feedback_base(exercise):
+    """
+    Lisätään/päivitetään palautepohja kaikkiin palautteisiin, joita ei ole
+    vielä muokattu. Jokaiselle kielelle tehdään yksi UPDATE-kysely.
     :param exercise: (Exercise model object)
-    :param feedback: (Feedback model object)
+    :return: (int) number of updated feedbacks
     """
-    if feedback.status == feedback.BASE:
-        if feedback.grader_lang_en and exercise.feedback_base_en:
-            feedback_base = exercise.feedback_base_en
-        elif exercise.feedback_base_fi:
-            feedback_base = exercise.feedback_base_fi
-        else:
-            feedback_base = exercise.feedback_base_en
+    if not (exercise.feedback_base_fi or exercise.feedback_base_en):
+        return 0
 
+    updated = 0
+
+    for grader_lang_en in (False, True):
+        updated += exercise.feedback_set.filter(
+            status=Feedback.BASE,
+            grader_lang_en=grader_lang_en
+        ).update(feedback=get_feedback_base(exercise, grader_lang_en))
+
+    return updated
+
+
+def get_feedback_base(exercise, grader_lang_en):
+    """
+    Read the feedback template matching the grader language. Template text
+    is cached by file name and modification time, so a replaced file is
+    read again.
+    :param exercise: (Exercise model object)
+    :param grader_lang_en: (bool) True if the feedback is given in English
+    :return: (str) template text
+    """
+    if grader_lang_en and exercise.feedback_base_en:
+        feedback_base = exercise.feedback_base_en
+    elif exercise.feedback_base_fi:
+        feedback_base = exercise.feedback_base_fi
+    else:
+        feedback_base = exercise.feedback_base_en
+
+    key = None
+
+    if feedback_base:
         try:
-            feedback.feedback = feedback_base.open().read().decode("utf-8")
-        except ValueError as e:
-            feedback.feedback = f"Feedback template cannot be read: {e}"
+            modified = feedback_base.storage.get_modified_time(
+                feedback_base.name
+            )
+            key = "feedback_base_" + hashlib.sha256(
+                f"{feedback_base.name}:{modified.timestamp()}".encode()
+            ).hexdigest()
+        except (NotImplementedError, OSError) as e:
+            util_logger.debug(e)
 
+    if key is not None:
+        text = cache.get(key)
+        if text is not None:
+            return text
+
+    try:
+        text = feedback_base.open().read().decode("utf-8")
+    except ValueError as e:
+        return f"Feedback template cannot be read: {e}"
+    finally:
         feedback_base.close()
-        feedback.save()
+
+    if key is not None:
+        cache.set(key, text, settings.FEEDBACK_BASE_CACHE_TIMEOUT)
+
+    return text
 
 
 def divide_submissions(exercise):
     """
     Jakaa palautukset kurssille merkittyjen assareiden kesken.
+    Assareiden nykyiset työmäärät haetaan yhdellä kyselyllä, arvostelija
+    valitaan muistissa kekojen avulla ja jako tallennetaan kerralla.
     param exercise: (models.Exercise) Tehtäväobjekti
     """
     if exercise.num_of_graders == 0:
         return
 
-    graders_fi_en = list(exercise.graders.all())
+    graders_fi_en = list(exercise.graders.values_list("id", flat=True))
     random.shuffle(graders_fi_en)
-    graders_en_only = list(exercise.graders_en.all())
+    graders_en_only = list(exercise.graders_en.values_list("id", flat=True))
     random.shuffle(graders_en_only)
     grader_count = len(graders_fi_en) + len(graders_en_only)
-    subs = exercise.feedback_set.all()
-    grader_max_now = subs.count() // exercise.num_of_graders
+
+    loads = defaultdict(int)
+    loads.update(
+        exercise.feedback_set.filter(grader__isnull=False).order_by()
+        .values_list("grader").annotate(Count("id"))
+    )
+    subs = list(exercise.feedback_set.filter(grader=None))
+    sub_count = len(subs) + sum(loads.values())
+    grader_max_now = sub_count // exercise.num_of_graders
+
+    pool_fi_en = create_grader_pool(graders_fi_en, loads)
+    pool_en_only = create_grader_pool(graders_en_only, loads)
+    assigned = []
     no_grader = []
 
     for sub in subs:
-        if sub.grader is None:
-            if sub in debug_feedbacks:
-                util_logger.debug(f"TÄLLÄ PITI OLLA JO GRADER: "
-                                  f"{sub} {sub.grader}")
-
-            grader = None
+        grader = None
 
-            if sub.grader_lang_en:
-                grader = choose_grader(exercise, graders_en_only,
-                                       grader_max_now)
+        if sub.grader_lang_en:
+            grader = choose_grader(pool_en_only, loads, grader_max_now)
 
-            # If still no grader, try to get any grader
-            if grader is None:
-                grader = choose_grader(exercise, graders_fi_en, grader_max_now)
+        # If still no grader, try to get any grader
+        if grader is None:
+            grader = choose_grader(pool_fi_en, loads, grader_max_now)
 
-            if grader:
-                grader.feedback_set.add(sub)
-            elif grader_count == exercise.num_of_graders:
-                no_grader.append(sub)
-            else:
-                # Rest of the submissions are left pending more graders
-                break
+        if grader is not None:
+            sub.grader_id = grader
+            assigned.append(sub)
+        elif grader_count == exercise.num_of_graders:
+            no_grader.append(sub)
+        else:
+            # Rest of the submissions are left pending more graders
+            break
 
     all_graders = graders_fi_en + graders_en_only
     random.shuffle(all_graders)
+    pool_all = create_grader_pool(all_graders, loads)
 
     for sub in no_grader:
         if sub.grader_lang_en:
-            grader = choose_grader(exercise, all_graders)
+            grader = choose_grader(pool_all, loads)
         else:
-            grader = choose_grader(exercise, graders_fi_en)
+            grader = choose_grader(pool_fi_en, loads)
 
-        if grader:
-            grader.feedback_set.add(sub)
+        if grader is not None:
+            sub.grader_id = grader
+            assigned.append(sub)
 
-    util_logger.debug(f"Arvosteltavia palautuksia: {subs.count()}")
+    if assigned:
+        Feedback.objects.bulk_update(assigned, ["grader"])
+        invalidate_feedback_counts(exercise.pk)
+
+    util_logger.debug(f"Arvosteltavia palautuksia: {sub_count}")
     util_logger.debug(f"Palautusta per assari: "
-                      f"{subs.count()/exercise.num_of_graders}")
+                      f"{sub_count/exercise.num_of_graders}")
     util_logger.debug("Assareilla arvostelussa:")
     for grader in graders_fi_en:
-        util_logger.debug(
-            f"{grader.feedback_set.filter(exercise=exercise).count()}"
-        )
+        util_logger.debug(f"{loads[grader]}")
+
 
+def create_grader_pool(graders, loads):
+    """
+    Luo keon, josta valitaan arvostelija, jolla on vähiten arvosteltavaa.
+    Tasatilanteessa valitaan listassa ensimmäisenä oleva.
+    :param graders: (list) assareiden id:t sekoitetussa järjestyksessä
+    :param loads: (dict) assareiden nykyiset työmäärät id:n mukaan
+    :return: (list) keko
+    """
+    pool = [(loads[grader], order, grader)
+            for order, grader in enumerate(graders)]
+    heapq.heapify(pool)
+    return pool
 
-def choose_grader(exercise, graders, max_sub_count=None):
+
+def choose_grader(pool, loads, max_sub_count=None):
     """
-    Jonkinlainen algoritmi töiden jakamiseen. Jakaa työ tasan kaikkien 
-    kurssiin liitettyjen assareiden kesken.
-    HUOM! Tämä ottaa nyt arvosteluun kaiken, myös assarien omat sekä 
-    testitunnuksilla tehdyt palautukset.
+    Valitsee keosta assarin, jolla on vähiten arvosteltavaa, ja kasvattaa
+    hänen työmääräänsä yhdellä. Sama assari voi kuulua useampaan kekoon,
+    joten vanhentuneet työmäärät päivitetään kekoon valinnan yhteydessä.
+    :param pool: (list) create_grader_pool -funktiolla luotu keko
+    :param loads: (dict) assareiden nykyiset työmäärät id:n mukaan
+    :param max_sub_count: (int) työmäärän yläraja, jos sellainen on
+    :return: (int) valitun assarin id tai None
     """
-    
-    min_sub_count = 0
-    grader_to_add = None
-    first = True
-    
-    for grader in graders:
-        if max_sub_count and grader.feedback_set.filter(
-                exercise=exercise).count() >= max_sub_count:
+    while pool:
+        load, order, grader = pool[0]
+
+        if load != loads[grader]:
+            heapq.heapreplace(pool, (loads[grader], order, grader))
             continue
 
-        # Valitaan pienimmän arvostelumäärän omaavaksi ensimmäinen
-        # vastaantuleva
-        elif first:
-            min_sub_count = grader.feedback_set.filter(
-                exercise=exercise).count()
-            grader_to_add = grader
-            first = False
-
-        # Jos ensimmäinen alkio on jo käsitelty,
-        # tutkitaan löytyykö sitä pienempää
-        elif grader.feedback_set.filter(
-                exercise=exercise).count() < min_sub_count:
-            min_sub_count = grader.feedback_set.filter(
-                exercise=exercise).count()
-            grader_to_add = grader
-            
-    # Tässä pitäisi ny olla se, jolla on vähiten arvosteltavaa, tai yksi
-    # niistä jolla on vähiten, jos usealla yhtä vähän. Tasatilanteessa ei ole
-    # väliä kuka valitaan.
-    return grader_to_add
+        if max_sub_count and load >= max_sub_count:
+            return None
 
+        loads[grader] += 1
+        heapq.heapreplace(pool, (load + 1, order, grader))
+        return grader
 
-def get_submission_data(feedback):
-    api_token = feedback.exercise.course.api_token
+    return None
 
-    exercise_details = get_json(feedback.exercise.api_url, api_token)
+
+def get_submission_data(feedback):
+    """
+    Retrieve the submission and the exercise details from Plussa and
+    collect the submitted files and texts. The requests and the file
+    downloads are made concurrently, at most SUBMISSION_FETCH_WORKERS at
+    a time.
+    :param feedback: (Feedback) model object
+    :return: (dict) submission data for the feedback view
+    """
+    exercise = feedback.exercise
+    data, max_points = fetch_submission_data(
+        exercise.api_url, exercise.course.api_root,
+        exercise.course.api_token, feedback.sub_id
+    )
 
     # Update exercise max_points
-    feedback.exercise.total_max_points = exercise_details["max_points"]
-    feedback.exercise.save()
+    if exercise.total_max_points != max_points:
+        exercise.total_max_points = max_points
+        exercise.save(update_fields=["total_max_points"])
+
+    return data
+
+
+def fetch_submission_data(exercise_url, api_root, api_token, sub_id):
+    """
+    Fetch the data of get_submission_data without touching the database,
+    so that it can also be run in a background thread. Exercise details
+    and submission info are cached and the files go to the render cache.
+    :param exercise_url: (str) A+ API url of the exercise
+    :param api_root: (str) A+ API root of the course
+    :param api_token: (str) A+ API token
+    :param sub_id: (int) submission id
+    :return: (tuple) submission data for the feedback view, max points
+    """
+    sub_url = f"{api_root}submissions/{sub_id}/"
+
+    with ThreadPoolExecutor(
+            max_workers=settings.SUBMISSION_FETCH_WORKERS) as executor:
+        details_future = executor.submit(get_json, exercise_url, api_token)
+        sub_future = executor.submit(get_json, sub_url, api_token)
+        exercise_details = details_future.result()
+        sub_info = sub_future.result()
+
+        form_spec = None
+
+        # If exercise is not handled by Plussa but PRP instead
+        # the exercise_info is null
+        if exercise_details["exercise_info"]:
+            form_spec = exercise_details["exercise_info"]["form_spec"]
+
+        inspect_url = sub_info["html_url"] + "inspect"
+        sub_data = []
 
-    form_spec = None
+        # Each form field gets its own list to keep them in order
+        # while the files are downloaded and highlighted concurrently
+        parts = []
+        futures = []
 
-    # If exercise is not handled by Plussa but PRP instead
-    # the exercise_info is null
-    if exercise_details["exercise_info"]:
-        form_spec = exercise_details["exercise_info"]["form_spec"]
+        if form_spec is not None:
+            # In case of git url the form_spec field exists but it's empty
+            if len(form_spec) == 0 and sub_info["submission_data"]:
+                get_git_url(sub_data, sub_info["submission_data"][0][1])
 
-    api_root = feedback.exercise.course.api_root
-    sub_url = f"{api_root}submissions/{feedback.sub_id}/"
-    sub_info = get_json(sub_url, api_token)
+            # In addition to the git url, submission can be text, code file
+            # or questionnaire. Questionnaires are not handled at all
+            # because usually there is no need to inspect them manually.
+            for field in form_spec:
+                part = []
+                parts.append(part)
 
-    inspect_url = sub_info["html_url"] + "inspect"
-    sub_data = []
+                if field["type"] == "file":
+                    futures.append(executor.submit(
+                        get_filecontent, part, field, sub_info["files"],
+                        api_token, sub_id
+                    ))
 
-    if form_spec is not None:
-        # In case of git url the form_spec field exists but it's empty
-        if len(form_spec) == 0 and sub_info["submission_data"]:
-            get_git_url(sub_data, sub_info["submission_data"][0][1])
+                elif field["type"] == "textarea":
+                    get_text(part, field, sub_info["submission_data"])
 
-        # In addition to the git url, submission can be text, code file or
-        # questionnaire. Questionnaires are not handled at all
-        # because usually there is no need to inspect them manually.
-        for field in form_spec:
-            if field["type"] == "file":
-                get_filecontent(sub_data, field, sub_info["files"], api_token)
+        for future in futures:
+            future.result()
 
-            elif field["type"] == "textarea":
-                get_text(sub_data, field, sub_info["submission_data"])
+    for part in parts:
+        sub_data.extend(part)
 
     return {
         "inspect_url": inspect_url,
         "sub_data": sub_data,
         "grading_data": sub_info["grading_data"],
         "feedback_lang": get_feedback_lang(sub_info["submission_data"])
-    }
+    }, exercise_details["max_points"]
 
 
 def get_feedback_lang(sub_data):
@@ -560,53 +1196,24 @@ def get_git_url(sub_data, url):
     )
 
 
-def get_filecontent(sub_data, form_field, files, token):
+def get_filecontent(sub_data, form_field, files, token, sub_id=None):
     """
     Etsii halutun tiedoston ja tallentaa sen tiedot listaan sanakirjamuodossa.
     :param sub_data: (list) Opiskelijan palautuksen olennaiset tiedot dicteinä.
     :param form_field: (dict) Tehtävän (yaml-tiedosto) palautuskentän tiedot.
     :param files: (dict) Palautettujen tiedostojen nimet, urlit jne.
+    :param token: (str) A+ API token
+    :param sub_id: (int) Palautuksen id, käytetään välimuistin avaimessa.
     :return: None
     """
     for file in files:
         if file["param_name"] == form_field["key"]:
-            resp = requests.get(file["url"],
-                                headers={"Authorization": f"Token {token}"})
-            resp.encoding = "utf-8"
+            rendered = render_file(file, token, sub_id)
 
             title = None
             text = None
-            style = None
-
-            try:
-                lexer = get_lexer_for_filename(file["filename"])
-                code = highlight(resp.text, lexer,
-                                 HtmlFormatter(linenos=True))
-            except ClassNotFound:
-                code = None
-
-            # Run PEP8 style check for Python file
-            if code and file["filename"].endswith(".py"):
-                lines = resp.text.rstrip("\n").split("\n")
-                lines = [line + "\n" for line in lines]
-                style_checker = pycodestyle.Checker(
-                    lines=lines,
-                    show_source=True
-                )
-
-                # check_all -metodi printtaa tulokset stdouttiin,
-                # joten luodaan bufferi, johon saadaan tulokset talteen
-                buffer = io.StringIO()
-                sys.stdout = buffer
-
-                style_checker.check_all()
-
-                # Palautetaan alkuperäinen stdout ja
-                # haetaan tarkastuksen tulokset bufferista
-                sys.stdout = sys.__stdout__
-                style = buffer.getvalue()
 
-            elif code is None:
+            if rendered["code"] is None:
                 title = form_field["title"]
                 text = "Follow the link to download file"
 
@@ -615,14 +1222,86 @@ def get_filecontent(sub_data, form_field, files, token):
                     "title": title,
                     "url": file["url"],
                     "text": text,
-                    "code": code,
-                    "style": style
+                    "code": rendered["code"],
+                    "style": rendered["style"]
                 }
             )
 
             return
 
 
+def render_file(file, token, sub_id=None):
+    """
+    Download a submitted file, highlight it and run the style check for
+    Python files. Submissions don't change, so the results are stored in
+    the render cache: by content hash, and from submission and file url to
+    the content hash. Reopening a submission needs no download at all.
+    :param file: (dict) file details from the submission info
+    :param token: (str) A+ API token
+    :param sub_id: (int) submission id
+    :return: (dict) highlighted html "code" and style check report "style"
+    """
+    render_cache = caches["render"]
+    file_key = "file_" + hashlib.sha256(
+        f"{sub_id}:{file['url']}".encode()
+    ).hexdigest()
+
+    digest = render_cache.get(file_key)
+    if digest is not None:
+        rendered = render_cache.get(f"render_{digest}")
+        if rendered is not None:
+            return rendered
+
+    resp = get_client(token).get(file["url"])
+    resp.encoding = "utf-8"
+
+    digest = hashlib.sha256(
+        file["filename"].encode() + b"\0" + resp.content
+    ).hexdigest()
+    rendered = render_cache.get(f"render_{digest}")
+
+    if rendered is None:
+        rendered = highlight_file(file["filename"], resp.text)
+        style_missing = rendered["code"] and rendered["diagnostics"] is None \
+            and file["filename"].endswith(".py")
+
+        if resp.status_code != requests.codes.ok or style_missing or \
+                len(resp.content) > settings.RENDER_CACHE_MAX_FILE_SIZE:
+            return rendered
+
+        render_cache.set(f"render_{digest}", rendered)
+
+    render_cache.set(file_key, digest)
+    return rendered
+
+
+def highlight_file(filename, content):
+    """
+    Highlight the file content and run PEP8 style check for Python files.
+    :param filename: (str) name of the file, used to choose the lexer
+    :param content: (str) file content
+    :return: (dict) highlighted html "code", style check report "style"
+             and the report as a list of per-line "diagnostics"
+    """
+    style = None
+    diagnostics = None
+
+    try:
+        lexer = get_lexer_for_filename(filename)
+        code = highlight(content, lexer, HtmlFormatter(linenos=True))
+    except ClassNotFound:
+        code = None
+
+    # Run PEP8 style check for Python file
+    if code and filename.endswith(".py"):
+        diagnostics = stylecheck.run_style_check(content)
+
+        if diagnostics is not None:
+            style = stylecheck.format_report(content, diagnostics)
+
+    return {"code": code, "style": style, "diagnostics": diagnostics}
+
+
 def get_text(sub_data, form_field, textareas):
     """
     Hakee tekstimuotoisen tehtävän kysymykset ja vastaukset.
@@ -4,25 +4,52 @@ Module comment here
 
 import csv
 import logging
-import requests
 
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
 from django.db.models import Q
 from django.forms import modelformset_factory
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         JsonResponse)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse, reverse_lazy
 from django.views import generic
 
-from .models import Course, Exercise, Feedback, Student
+from .models import Course, Exercise, Feedback, Job, Student
+from .prefetch import cancel_prefetch, prefetch_next, wait_for_prefetch
+from .release import get_release_status, queue_release, resolve_uncertain
 import submissions.forms as forms
 import submissions.utils as utils
 
 
 view_logger = logging.getLogger(__name__)
 
+# Messages shown when a background job started by the user has finished
+JOB_MESSAGES = {
+    "get_exercises": ("Course content updated",
+                      "Failed to retrieve exercises"),
+    "update_submissions": ("Submissions updated",
+                           "Failed to retrieve submissions"),
+    "apply_grading_settings": ("Grading settings applied to submissions",
+                               "Failed to apply grading settings"),
+    "release": ("Feedbacks posted to Plussa",
+                "Failed to post feedbacks to Plussa"),
+}
+
+
+def follow_job(request, job):
+    """
+    Show the result of the job to the user when it has finished. Jobs are
+    kept in the session and polled by the pages, see JobStatusView.
+    :param request: (HttpRequest) request which started the job
+    :param job: (Job) model object
+    """
+    jobs = request.session.get("jobs", [])
+
+    if job.pk not in jobs:
+        request.session["jobs"] = jobs + [job.pk]
+
 
 class ExerciseMixin:
     def get_context_data(self, **kwargs):
@@ -34,13 +61,9 @@ class ExerciseMixin:
             context["user_is_teacher"] = exercise.course.is_teacher(
                 self.request.user
             )
-            context["feedback_count"] = exercise.feedback_set.all().count()
-            context["ready_count"] = exercise.feedback_set.filter(
-                status=Feedback.READY
-            ).count()
-            context["grader_lang_en"] = exercise.feedback_set.filter(
-                grader_lang_en=True
-            ).count()
+            context.update(
+                utils.get_feedback_counts(exercise, self.request.user)
+            )
 
         return context
 
@@ -63,6 +86,8 @@ class CourseListView(LoginRequiredMixin, generic.ListView):
     
     def get(self, request, *args, **kwargs):
 
+        cancel_prefetch(request.user)
+
         #TODO: Show all courses if user is superuser
         self.object_list = Course.objects.filter(
             Q(
@@ -89,6 +114,8 @@ class ExerciseListView(LoginRequiredMixin, generic.ListView):
         if not course.is_staff(request.user):
             raise PermissionDenied
 
+        cancel_prefetch(request.user)
+
         self.object_list = self.get_queryset().filter(
             course=course).filter(in_grading=True)
 
@@ -143,13 +170,14 @@ class GetExercisesRedirectView(LoginRequiredMixin, generic.RedirectView):
     def post(self, request, *args, **kwargs):
         course = get_object_or_404(Course, pk=kwargs["pk"])
 
-        # TODO: voiko jotain mennä pieleen, että tehtäviä ei päivitetäkään?
         # get exercises from Plussa and save them to database
-        utils.get_exercises(course)
+        job = Job.objects.enqueue("get_exercises", user=request.user,
+                                  course_id=course.pk)
+        follow_job(request, job)
 
         # Information passed to template which tab to show
         request.session["show_set_grading"] = True
-        messages.success(request, "Course content updated")
+        messages.success(request, "Course content is being updated")
 
         return self.get(request, *args, **kwargs)
 
@@ -162,11 +190,10 @@ class UpdateSubmissionsRedirectView(LoginRequiredMixin, generic.RedirectView):
     # TODO: muuttaa tietokannan tilaa, joten muuta postiksi
     def get(self, request, *args, **kwargs):
         exercise = get_object_or_404(Exercise, pk=kwargs["pk"])
-        try:
-            utils.update_submissions(exercise)
-            messages.success(request, "Submissions updated")
-        except requests.HTTPError as e:
-            messages.error(request, f"Failed to retrieve submissions: {e}")
+        job = Job.objects.enqueue("update_submissions", user=request.user,
+                                  exercise_id=exercise.pk)
+        follow_job(request, job)
+        messages.success(request, "Submissions are being updated")
 
         return super().get(request, *args, **kwargs)
 
@@ -252,28 +279,11 @@ class UpdateExerciseInGradingView(LoginRequiredMixin, generic.edit.UpdateView):
             self.object.num_of_graders = all_graders
             self.object.save()
 
-        # Minimum points of accepted submission have been increased.
-        # Remove submissions with points lesser than new limit but
-        # only if the feedback status is still template.
-        self.object.feedback_set.filter(
-            status=Feedback.BASE,
-            auto_grade__lt=self.object.min_points
-        ).delete()
-
-        # Maximum points for auto grade have been decreased.
-        # Remove submissions with points greater than new limit but
-        # only if the feedback status is still template.
-        if self.object.max_points is not None:
-            self.object.feedback_set.filter(
-                status=Feedback.BASE,
-                auto_grade__gt=self.object.max_points
-            ).delete()
-
-        # Update feedback base if it exists. Update is done only
-        # if Feedback object's status is Feedback.BASE
-        if self.object.feedback_base_fi or self.object.feedback_base_en:
-            for feedback in self.object.feedback_set.all():
-                utils.add_feedback_base(self.object, feedback)
+        # Removing and updating the feedbacks can take a while
+        job = Job.objects.enqueue("apply_grading_settings",
+                                  user=self.request.user,
+                                  exercise_id=self.object.pk)
+        follow_job(self.request, job)
 
         messages.success(self.request, "Changes saved successfully")
         return super().form_valid(form)
@@ -352,15 +362,14 @@ class GradingListView(ExerciseMixin, LoginRequiredMixin,
                                                 form=forms.SetGraderMeForm,
                                                 extra=0)
         no_grader_set = self.get_queryset().filter(
-            exercise=context["exercise"]).filter(grader=None)
+            exercise=context["exercise"]).filter(grader=None).for_listing()
         context["formset"] = SetGraderFormset(queryset=no_grader_set)
-
-        context["my_ready_count"] = self.object_list.filter(
-            status=Feedback.READY
-        ).count()
-
-        context["my_feedback_count"] = self.object_list.count()
         context["batch_assess_form"] = forms.BatchAssessForm()
+
+        if context["user_is_teacher"]:
+            context["uncertain"] = context["exercise"].feedback_set.filter(
+                release_state=Feedback.UNCERTAIN
+            ).select_related("grader")
         
         return context
     
@@ -371,9 +380,10 @@ class GradingListView(ExerciseMixin, LoginRequiredMixin,
             raise PermissionDenied
 
         # update_submissions(exercise)
+        cancel_prefetch(request.user, keep_exercise=exercise.pk)
 
         self.object_list = self.get_queryset().filter(
-            exercise=exercise).filter(grader=request.user)
+            exercise=exercise).filter(grader=request.user).for_listing()
 
         return self.render_to_response(self.get_context_data())
 
@@ -430,7 +440,12 @@ class SubmissionsFormView(ExerciseMixin, LoginRequiredMixin,
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         exercise = get_object_or_404(Exercise, pk=self.kwargs["pk"])
-        kwargs["queryset"] = exercise.feedback_set.all()
+        kwargs["queryset"] = exercise.feedback_set.for_listing()
+        kwargs["form_kwargs"] = {
+            "grader_choices": utils.get_staff_choices(
+                exercise.course.base_course_id
+            )
+        }
         return kwargs
 
     def get_success_url(self):
@@ -473,7 +488,10 @@ class FeedbackView(ExerciseMixin, LoginRequiredMixin,
         context = super().get_context_data(**kwargs)
 
         # Get the information about the submission and add it to the context.
+        # The submission may already be on its way if it was prefetched.
+        wait_for_prefetch(self.request.user, self.object.sub_id)
         context.update(utils.get_submission_data(self.object))
+        prefetch_next(self.request.user, self.object)
 
         # Näkymään pääsee kahden eri sivun kautta, joten murupolkua
         # varten lisätään kontekstiin tieto siitä mistä tultiin.
@@ -561,8 +579,11 @@ class BatchAssessRedirectView(LoginRequiredMixin, generic.RedirectView):
 
 
 class ReleaseFeedbacksRedirectView(LoginRequiredMixin, generic.RedirectView):
-    # TODO: näytä errorviestissä mistä palautuksesta error tuli
-    # TODO: pitää tehdä koko julkaisujuttu kokonaan toisella tavalla
+    """
+    Queue the user's feedbacks with status READY to be posted to Plussa.
+    Feedbacks are posted in the background, progress can be followed
+    with ReleaseStatusView.
+    """
     pattern_name = "submissions:grading"
 
     def post(self, request, *args, **kwargs):
@@ -571,51 +592,102 @@ class ReleaseFeedbacksRedirectView(LoginRequiredMixin, generic.RedirectView):
         if not exercise.course.is_staff(request.user):
             raise PermissionDenied
 
-        feedbacks = exercise.feedback_set.filter(grader=request.user,
-                                                 status=Feedback.READY,
-                                                 released=False)
+        count = queue_release(exercise, request.user)
 
-        url = f"{exercise.api_url}/submissions/"
-        auth = {"Authorization": f"Token {exercise.course.api_token}"}
-        
-        if feedbacks:
-            for i in range(0, len(feedbacks)):
-                json_object = utils.create_json_object(feedbacks[i])
-
-                try:
-                    view_logger.debug(f"POST {i}")
-                    resp = requests.post(url, json=json_object, headers=auth)
-                except Exception as e:
-                    view_logger.debug(e)
-                    messages.error(
-                        request,
-                        f"{e}\nReleased {i} feedbacks with status READY"
-                        f"\n{feedbacks.count()-i} left unreleased"
-                    )
-                    break
-
-                if resp.status_code == 201:
-                    view_logger.debug(f"Success, saved {i}")
-                    feedbacks[i].released = True
-                    feedbacks[i].save()
-                else:
-                    messages.error(
-                        request,
-                        f"{resp.status_code} {resp.text}\n"
-                        f"Released {i} feedbacks with status READY"
-                        f"\n{feedbacks.count()-i} left unreleased"
-                    )
-                    break
-            else:
-                messages.success(request,
-                                 f"Released {feedbacks.count()} feedbacks"
-                                 f" with status READY")
+        if count:
+            messages.success(request,
+                             f"Releasing {count} feedbacks with status READY")
         else:
             messages.info(request, "No feedbacks with status READY")
-            
+
+        return self.get(request, *args, **kwargs)
+
+
+class ResolveReleaseRedirectView(LoginRequiredMixin, generic.RedirectView):
+    """
+    Queue the feedbacks with unknown release outcome again or mark them
+    released after the teacher has checked them from Plussa.
+    """
+    pattern_name = "submissions:grading"
+
+    def post(self, request, *args, **kwargs):
+        exercise = get_object_or_404(Exercise, pk=kwargs["pk"])
+
+        if not exercise.course.is_teacher(request.user):
+            raise PermissionDenied
+
+        released = "mark_released" in request.POST
+        count = resolve_uncertain(exercise, request.user,
+                                  request.POST.getlist("feedbacks"),
+                                  released)
+
+        if not count:
+            messages.info(request, "No feedbacks selected")
+        elif released:
+            messages.success(request, f"{count} feedbacks marked released")
+        else:
+            messages.success(request, f"Releasing {count} feedbacks again")
+
         return self.get(request, *args, **kwargs)
 
 
+class ReleaseStatusView(LoginRequiredMixin, generic.View):
+    """
+    Return the release progress of the user's feedbacks as json.
+    """
+
+    def get(self, request, *args, **kwargs):
+        exercise = get_object_or_404(Exercise, pk=kwargs["pk"])
+
+        if not exercise.course.is_staff(request.user):
+            raise PermissionDenied
+
+        return JsonResponse(get_release_status(exercise, request.user))
+
+
+class JobStatusView(LoginRequiredMixin, generic.View):
+    """
+    Return the status of a background job as json to the user who queued
+    it and to the staff of its course. A finished job is no longer followed
+    by the pages, see follow_job.
+    """
+
+    def get(self, request, *args, **kwargs):
+        job = Job.objects.filter(pk=kwargs["pk"]).first()
+        jobs = request.session.get("jobs", [])
+
+        if job is None or job.finished:
+            if kwargs["pk"] in jobs:
+                jobs.remove(kwargs["pk"])
+                request.session["jobs"] = jobs
+
+        if job is None:
+            raise Http404
+
+        # The same job may have been queued by another user of the course
+        if job.user != request.user:
+            course = job.get_course()
+            if course is None or not course.is_staff(request.user):
+                raise PermissionDenied
+
+        done, failed = JOB_MESSAGES.get(job.kind, (str(job), str(job)))
+
+        if job.status == Job.FAILED:
+            message = f"{failed}: {job.error}"
+        else:
+            message = done
+
+        return JsonResponse({
+            "kind": job.kind,
+            "status": job.get_status_display(),
+            "message": message,
+            "error": job.error,
+            "created": job.created,
+            "started": job.started,
+            "finished": job.finished,
+        })
+
+
 class CreateJsonFromFeedbacksView(LoginRequiredMixin, generic.TemplateView):
     template_name = "submissions/json.html"
 
@@ -673,7 +745,7 @@ class DownloadCsvView(LoginRequiredMixin, generic.View):
         writer = csv.writer(response)
         writer.writerow(header)
 
-        for feedback in exercise.feedback_set.all():
+        for feedback in exercise.feedback_set.for_listing():
             status = Feedback.STATUS_CHOICES[feedback.status][1]
 
             for student in feedback.students.all():